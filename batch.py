@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+'''
+    batch.py
+
+    Depends on lundump.py, lparser.py, lcache.py, lexport.py, lconvert.py && lprofile.py.
+
+    Disassembles && decompiles whole directories (or globs) of lua dumps at once, spread across a pool of worker
+    processes. A file that fails to decompile is reported and skipped, it never takes the rest of the batch down.
+'''
+
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lundump
+import lparser
+import lcache
+import lexport
+import lconvert
+import lprofile
+
+# each worker process gets its own decompilation cache (see initWorker()), entries are shared through the cache dir
+_cache: lcache.DecompCache = None
+_snapshots: lcache.SnapshotCache = None
+
+def initWorker(cacheDir: str, profile: bool = False, snapshotDir: str = None):
+    global _cache, _snapshots
+    if cacheDir is not None:
+        _cache = lcache.DecompCache(directory=cacheDir)
+
+    if snapshotDir is not None:
+        _snapshots = lcache.SnapshotCache(directory=snapshotDir)
+
+    if profile:
+        lprofile.enable()
+
+def emitDisassembly(chunk: lundump.Chunk) -> str:
+    out = io.StringIO()
+    chunk.print(out)
+
+    return out.getvalue()
+
+def emitTable(chunk: lundump.Chunk) -> str:
+    out = io.StringIO()
+    chunk.print(out, compact=True)
+
+    return out.getvalue()
+
+def emitPseudoCode(chunk: lundump.Chunk) -> str:
+    if _cache is not None:
+        return lparser.decompileCached(chunk, _cache)
+
+    return lparser.LuaDecomp(chunk).getPseudoCode()
+
+def emitJSONL(chunk: lundump.Chunk) -> str:
+    out = io.StringIO()
+    lexport.writeJSONL(lexport.walkProtos(chunk), out)
+
+    return out.getvalue()
+
+# every output we know how to write, by name: (file extension, emitter(chunk) -> str)
+EMITTERS = {
+    'lua': ('.lua', emitPseudoCode),
+    'dis': ('.dis', emitDisassembly),
+    'tsv': ('.tsv', emitTable),
+    'jsonl': ('.jsonl', emitJSONL),
+}
+
+# expands files, directories && globs into a list of (path, root) pairs. root is what the output tree mirrors: a
+# directory's files mirror the directory, while single files (&& glob matches) mirror the deepest directory they all
+# share, so files from different directories never land on the same output
+def findInputs(patterns: list[str], extensions: list[str]) -> list[tuple[str, str]]:
+    inputs = []
+    files = []
+    seen = set()
+
+    def add(path: str, root: str = None):
+        if os.path.abspath(path) in seen:
+            return
+
+        seen.add(os.path.abspath(path))
+        inputs.append((path, root))
+        if root is None:
+            files.append(len(inputs) - 1)
+
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+
+        for match in sorted(matches):
+            if os.path.isdir(match):
+                for dirpath, dirnames, filenames in os.walk(match):
+                    dirnames.sort()
+                    for name in sorted(filenames):
+                        if os.path.splitext(name)[1] in extensions:
+                            add(os.path.join(dirpath, name), match)
+            else:
+                add(match)
+
+    if len(files) > 0:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(inputs[i][0])) for i in files])
+        for i in files:
+            inputs[i] = (inputs[i][0], root)
+
+    return inputs
+
+# every output path that more than one input would write to, as {output: [inputs]}. different directory inputs can
+# still share relative paths (eg. 'a/x.luac' && 'b/x.luac' passed as the directories 'a' && 'b')
+def findCollisions(inputs: list[tuple[str, str]], outDir: str, emit: list[str], retarget: str = None) -> dict:
+    exts = [EMITTERS[name][0] for name in emit]
+    if retarget is not None:
+        exts.append(".%s.luac" % retarget)
+
+    outputs = {}
+    for path, root in inputs:
+        for ext in exts:
+            outputs.setdefault(os.path.abspath(outputPath(path, root, outDir, ext)), []).append(path)
+
+    return {out: paths for out, paths in outputs.items() if len(paths) > 1}
+
+# where the [ext] output for [path] goes. with no [outDir], outputs are written next to their input
+def outputPath(path: str, root: str, outDir: str, ext: str) -> str:
+    base = os.path.splitext(path)[0] + ext
+    if outDir is None:
+        return base
+
+    return os.path.join(outDir, os.path.relpath(base, root or "."))
+
+# runs in a worker process. never raises, errors are reported in the returned entry instead
+def processFile(job: tuple) -> dict:
+    path, root, outDir, emit, retarget = job
+    entry = {"file": path, "bytes": 0, "seconds": 0.0, "outputs": [], "error": None}
+    start = time.perf_counter()
+    hits, misses = (_cache.hits, _cache.misses) if _cache is not None else (0, 0)
+
+    try:
+        entry["bytes"] = os.path.getsize(path)
+        if len(emit) == 0:
+            chunk = None
+        elif _snapshots is not None:
+            chunk = _snapshots.loadFile(path)
+        else:
+            chunk = lundump.LuaUndump().loadFile(path)
+
+        for name in emit:
+            ext, emitter = EMITTERS[name]
+            out = outputPath(path, root, outDir, ext)
+            os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+
+            with open(out, 'w', encoding='utf-8') as f:
+                f.write(emitter(chunk))
+            entry["outputs"].append(out)
+
+        # re-targeting streams the dump straight from the input, it doesn't need the chunk
+        if retarget is not None:
+            out = outputPath(path, root, outDir, ".%s.luac" % retarget)
+            os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+
+            lconvert.convertFile(path, out, lundump.PROFILES[retarget])
+            entry["outputs"].append(out)
+    except Exception as e:
+        entry["error"] = "%s: %s" % (type(e).__name__, e)
+
+    entry["seconds"] = time.perf_counter() - start
+
+    # each file gets its own profile, they're merged back together by runBatch()
+    profiler = lprofile.active()
+    if profiler is not None:
+        entry["profile"] = profiler.report()
+        lprofile.enable()
+    if _cache is not None:
+        entry["cacheHits"] = _cache.hits - hits
+        entry["cacheMisses"] = _cache.misses - misses
+
+    return entry
+
+# if [retarget] names a profile (see lundump.PROFILES), every input is also converted to it as <name>.<profile>.luac
+def runBatch(inputs: list[tuple[str, str]], outDir: str = None, emit: list[str] = ('lua', 'dis'), jobs: int = None,
+             quiet: bool = False, cacheDir: str = None, retarget: str = None, profile: bool = False,
+             snapshotDir: str = None) -> dict:
+    collisions = findCollisions(inputs, outDir, emit, retarget)
+    if len(collisions) > 0:
+        out, paths = next(iter(collisions.items()))
+        raise Exception("Inputs would overwrite each other's outputs! [%s <- %s]" % (out, ", ".join(paths)))
+
+    entries = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1, initializer=initWorker, initargs=(cacheDir, profile, snapshotDir)) as pool:
+        futures = {pool.submit(processFile, (path, root, outDir, list(emit), retarget)): path for path, root in inputs}
+
+        for future in as_completed(futures):
+            try:
+                entry = future.result()
+            except Exception as e: # the worker itself died
+                entry = {"file": futures[future], "bytes": 0, "seconds": 0.0, "outputs": [], "error": "%s: %s" % (type(e).__name__, e)}
+
+            if entry["error"] and not quiet:
+                print("%s: %s" % (entry["file"], entry["error"]), file=sys.stderr)
+            entries.append(entry)
+
+    elapsed = time.perf_counter() - start
+    totalBytes = sum(e["bytes"] for e in entries)
+    failures = sum(1 for e in entries if e["error"])
+
+    entries.sort(key=lambda e: e["file"])
+    report = {
+        "files": len(entries),
+        "failures": failures,
+        "bytes": totalBytes,
+        "seconds": elapsed,
+        "filesPerSecond": len(entries) / elapsed if elapsed > 0 else 0.0,
+        "mbPerSecond": (totalBytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0.0,
+    }
+
+    if cacheDir is not None:
+        report["cacheHits"] = sum(e.get("cacheHits", 0) for e in entries)
+        report["cacheMisses"] = sum(e.get("cacheMisses", 0) for e in entries)
+
+    if profile:
+        profiler = lprofile.Profiler()
+        for e in entries:
+            if "profile" in e:
+                profiler.merge(e.pop("profile"))
+        report["profile"] = profiler.report()
+
+    report["results"] = entries
+    return report
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch disassemble && decompile Lua 5.1 dumps.")
+    parser.add_argument("inputs", nargs="+", help="dump files, directories or globs")
+    parser.add_argument("-o", "--out", default=None, help="write outputs into this directory tree instead of next to each input")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (defaults to the cpu count)")
+    parser.add_argument("-e", "--emit", default="lua,dis", help="comma separated outputs to write (%s)" % ", ".join(EMITTERS))
+    parser.add_argument("--ext", action="append", default=None, help="file extension to pick up from directories (default: .luac)")
+    parser.add_argument("--report", default=None, help="write a JSON report of the run to this file")
+    parser.add_argument("--cache", default=None, help="reuse decompiled protos cached in this directory between runs")
+    parser.add_argument("--snapshots", default=None, help="reuse parsed dumps snapshotted in this directory between runs")
+    parser.add_argument("--retarget", default=None, choices=list(lundump.PROFILES), help="also convert every input to this header profile")
+    parser.add_argument("--profile", action="store_true", help="print (and report) where the time went, per stage, opcode && proto")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't print per-file errors")
+    args = parser.parse_args(argv)
+
+    emit = [e for e in args.emit.split(",") if e]
+    for e in emit:
+        if e not in EMITTERS:
+            parser.error("unknown output '%s'" % e)
+
+    inputs = findInputs(args.inputs, args.ext or [".luac"])
+    collisions = findCollisions(inputs, args.out, emit, args.retarget)
+    for out, paths in collisions.items():
+        print("%s would be written by %s" % (out, ", ".join(paths)), file=sys.stderr)
+    if len(collisions) > 0:
+        parser.error("%d outputs collide, pass the inputs' parent directory instead" % len(collisions))
+
+    report = runBatch(inputs, args.out, emit, args.jobs, args.quiet, args.cache, args.retarget, args.profile, args.snapshots)
+
+    print("%d files (%d failed), %.2f MB in %.2fs: %.1f files/s, %.2f MB/s" % (
+        report["files"], report["failures"], report["bytes"] / (1024 * 1024), report["seconds"],
+        report["filesPerSecond"], report["mbPerSecond"]), file=sys.stderr)
+    if args.cache:
+        print("cache: %d hits, %d misses" % (report["cacheHits"], report["cacheMisses"]), file=sys.stderr)
+
+    if args.profile:
+        profiler = lprofile.Profiler()
+        profiler.merge(report["profile"])
+        print(profiler.format(), file=sys.stderr)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if report["failures"] > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+'''
+    bench.py
+
+    Depends on lundump.py && lparser.py.
+
+    Benchmarks for the undumper, disassembler, decompiler && dumper. Every corpus is generated in memory through
+    LuaDump (so no luac is needed) && is the same on every run, covering the shapes that tend to hurt: lots of small
+    protos, one giant proto, deeply nested closures, huge constant pools && long SETLIST tables. Each stage is timed
+    on its own, results can be saved as json && compared against a saved baseline to catch regressions.
+'''
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+
+from lundump import Chunk, Constant, ConstType, Instruction, LuaDump, LuaUndump, Opcodes, instr_lookup_tbl
+from lparser import LuaDecomp
+
+BENCH_VERSION = 1
+
+# ========================================[[ Corpus ]]=========================================
+
+def _instr(op: Opcodes, A: int, B: int = 0, C: int = 0) -> Instruction:
+    template = instr_lookup_tbl[op]
+    instr = Instruction(template.type, template.name)
+    instr.opcode = int(op)
+    instr.A = A
+    instr.B = B
+    instr.C = C
+    return instr
+
+def _rk(indx: int) -> int:
+    return indx | (1 << 8)
+
+# builds a proto out of a list of instructions && constants (python values, None for nil)
+def _proto(name: str, instrs: list[Instruction], consts: list, protos: list[Chunk] = (), maxStack: int = 8,
+           isVarg: bool = False) -> Chunk:
+    chunk = Chunk()
+    chunk.name = name
+    chunk.isVarg = isVarg
+    chunk.maxStack = maxStack
+
+    for i, instr in enumerate(instrs):
+        chunk.appendInstruction(instr)
+        chunk.appendLine(i + 1)
+
+    for k in consts:
+        if k is None:
+            chunk.appendConstant(Constant(ConstType.NIL, None))
+        elif isinstance(k, bool):
+            chunk.appendConstant(Constant(ConstType.BOOL, k))
+        elif isinstance(k, (int, float)):
+            chunk.appendConstant(Constant(ConstType.NUMBER, float(k)))
+        else:
+            chunk.appendConstant(Constant(ConstType.STRING, k))
+
+    for p in protos:
+        chunk.appendProto(p)
+
+    return chunk
+
+# print("<msg>")
+def _printProto(msg: str) -> Chunk:
+    return _proto("", [
+        _instr(Opcodes.GETGLOBAL, 0, 0), _instr(Opcodes.LOADK, 1, 1), _instr(Opcodes.CALL, 0, 2, 1),
+        _instr(Opcodes.RETURN, 0, 1),
+    ], ["print", msg])
+
+# [count] globals, each set to a tiny function
+def manySmall(count: int) -> Chunk:
+    instrs = []
+    for i in range(count):
+        instrs += [_instr(Opcodes.CLOSURE, 0, i), _instr(Opcodes.SETGLOBAL, 0, i)]
+    instrs.append(_instr(Opcodes.RETURN, 0, 1))
+
+    return _proto("@manySmall.lua", instrs, ["fn%d" % i for i in range(count)],
+                  [_printProto("fn%d" % i) for i in range(count)], isVarg=True)
+
+# one proto with [count] statements, mixing arithmetic, globals && numeric for loops
+def giantProto(count: int) -> Chunk:
+    consts = ["print", 1, 10, 2]
+    instrs = []
+    for i in range(count):
+        consts.append("g%d" % i)
+        g = len(consts) - 1
+
+        if i % 4 == 3: # for i = 1, 10 do print(i) end
+            instrs += [
+                _instr(Opcodes.LOADK, 0, 1), _instr(Opcodes.LOADK, 1, 2), _instr(Opcodes.LOADK, 2, 1),
+                _instr(Opcodes.FORPREP, 0, 3), _instr(Opcodes.GETGLOBAL, 4, 0), _instr(Opcodes.MOVE, 5, 3),
+                _instr(Opcodes.CALL, 4, 2, 1), _instr(Opcodes.FORLOOP, 0, -4),
+            ]
+        else: # gN = gN * 2 + 1
+            instrs += [
+                _instr(Opcodes.GETGLOBAL, 0, g), _instr(Opcodes.MUL, 0, 0, _rk(3)),
+                _instr(Opcodes.ADD, 0, 0, _rk(1)), _instr(Opcodes.SETGLOBAL, 0, g),
+            ]
+    instrs.append(_instr(Opcodes.RETURN, 0, 1))
+
+    return _proto("@giantProto.lua", instrs, consts, isVarg=True)
+
+# closures nested [depth] deep, each one calling the next
+def deepNesting(depth: int) -> Chunk:
+    proto = _printProto("innermost")
+    for i in range(depth):
+        proto = _proto("" if i < depth - 1 else "@deepNesting.lua", [
+            _instr(Opcodes.CLOSURE, 0, 0), _instr(Opcodes.CALL, 0, 1, 1), _instr(Opcodes.RETURN, 0, 1),
+        ], [], [proto], isVarg=(i == depth - 1))
+
+    return proto
+
+# [count] globals, each set to its own (string or number) constant. some strings have bytes >= 0x80, so they only
+# survive a round trip if the undumper && dumper agree on the codec
+def hugeConstants(count: int) -> Chunk:
+    consts = []
+    instrs = []
+    for i in range(count):
+        consts += ["k%d" % i, ("valu\xe9 %d" % i) if i % 4 == 0 else ("value %d" % i) if i % 2 == 0 else i * 0.5]
+        instrs += [_instr(Opcodes.LOADK, 0, len(consts) - 1), _instr(Opcodes.SETGLOBAL, 0, len(consts) - 2)]
+    instrs.append(_instr(Opcodes.RETURN, 0, 1))
+
+    return _proto("@hugeConstants.lua", instrs, consts, isVarg=True)
+
+# a table constructor with [count] elements, flushed 50 at a time (LFIELDS_PER_FLUSH)
+def longSetlist(count: int) -> Chunk:
+    consts = ["tbl"] + [i for i in range(1, 51)]
+    instrs = [_instr(Opcodes.NEWTABLE, 0, 0, 0)]
+    for batch in range(0, count, 50):
+        num = min(50, count - batch)
+        instrs += [_instr(Opcodes.LOADK, i + 1, i + 1) for i in range(num)]
+        instrs.append(_instr(Opcodes.SETLIST, 0, num, batch // 50 + 1))
+    instrs += [_instr(Opcodes.SETGLOBAL, 0, 0), _instr(Opcodes.RETURN, 0, 1)]
+
+    return _proto("@longSetlist.lua", instrs, consts, maxStack=51, isVarg=True)
+
+# [depth] repeat-until loops nested in each other, each calling f() && looping until g is set
+def nestedRepeats(depth: int) -> Chunk:
+    instrs = []
+    for i in range(depth):
+        instrs += [_instr(Opcodes.GETGLOBAL, 0, 0), _instr(Opcodes.CALL, 0, 1, 1)]
+
+    # innermost loop first, each one jumps back to its own first call
+    for i in range(depth):
+        target = 2 * (depth - 1 - i)
+        instrs += [_instr(Opcodes.GETGLOBAL, 0, 1), _instr(Opcodes.TEST, 0, 0, 0)]
+        instrs.append(_instr(Opcodes.JMP, 0, target - (len(instrs) + 1)))
+    instrs.append(_instr(Opcodes.RETURN, 0, 1))
+
+    return _proto("@nestedRepeats.lua", instrs, ["f", "g"], isVarg=True)
+
+# name -> (generator, size at scale 1)
+CORPORA = {
+    "manySmall": (manySmall, 2000),
+    "giantProto": (giantProto, 5000),
+    "deepNesting": (deepNesting, 60),
+    "hugeConstants": (hugeConstants, 20000),
+    "longSetlist": (longSetlist, 5000),
+    "nestedRepeats": (nestedRepeats, 200),
+}
+
+def buildCorpus(name: str, scale: float = 1.0) -> bytes:
+    generator, size = CORPORA[name]
+    return bytes(LuaDump(generator(max(1, int(size * scale)))).dump())
+
+# ========================================[[ Timing ]]=========================================
+
+def _decode(data: bytes) -> Chunk:
+    return LuaUndump().decode_rawbytecode(data)
+
+def _disassemble(chunk: Chunk) -> None:
+    chunk.print(io.StringIO())
+
+def _decompile(chunk: Chunk) -> None:
+    LuaDecomp(chunk).getPseudoCode()
+
+def _dump(chunk: Chunk) -> None:
+    LuaDump(chunk).dump()
+
+STAGES = ["decode", "disassemble", "decompile", "dump"]
+
+# runs [fn]([arg]) [repeat] times, returns every run's time in seconds
+def _time(fn, arg, repeat: int) -> list[float]:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        runs.append(time.perf_counter() - start)
+
+    return runs
+
+def _summarize(runs: list[float]) -> dict:
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+def benchCorpus(name: str, scale: float = 1.0, repeat: int = 5, stages: list[str] = STAGES) -> dict:
+    data = buildCorpus(name, scale)
+    chunk = _decode(data)
+
+    numInstrs = 0
+    numProtos = 0
+    todo = [chunk]
+    while len(todo) > 0:
+        proto = todo.pop()
+        numInstrs += len(proto.instructions)
+        numProtos += 1
+        todo.extend(proto.protos)
+
+    result = {"bytes": len(data), "protos": numProtos, "instructions": numInstrs, "stages": {}}
+    for stage in stages:
+        if stage == "decode":
+            runs = _time(_decode, data, repeat)
+        else:
+            runs = _time({"disassemble": _disassemble, "decompile": _decompile, "dump": _dump}[stage], chunk, repeat)
+        result["stages"][stage] = _summarize(runs)
+
+    return result
+
+def runBenchmarks(corpora: list[str] = None, scale: float = 1.0, repeat: int = 5, stages: list[str] = STAGES,
+                  log = None) -> dict:
+    results = {
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "corpora": {},
+    }
+
+    for name in corpora or list(CORPORA):
+        result = benchCorpus(name, scale, repeat, stages)
+        results["corpora"][name] = result
+
+        if log is not None:
+            log("%-14s %8d instrs  %s" % (name, result["instructions"], "  ".join(
+                "%s %.4fs" % (stage, r["median"]) for stage, r in result["stages"].items())))
+
+    return results
+
+# compares median times against [baseline]. returns a list of (corpus, stage, baseline, current, ratio) for every
+# stage that got more than [threshold] slower
+def compareResults(results: dict, baseline: dict, threshold: float = 0.10) -> list[tuple]:
+    if baseline.get("scale") != results.get("scale"):
+        raise Exception("Baseline was run at a different scale! [%s != %s]" % (baseline.get("scale"), results.get("scale")))
+
+    regressions = []
+    for name, result in results["corpora"].items():
+        base = baseline["corpora"].get(name)
+        if base is None:
+            continue
+
+        for stage, r in result["stages"].items():
+            if stage not in base["stages"]:
+                continue
+
+            before = base["stages"][stage]["median"]
+            ratio = r["median"] / before if before > 0 else 1.0
+            if ratio > 1.0 + threshold:
+                regressions.append((name, stage, before, r["median"], ratio))
+
+    return regressions
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark undumping, disassembling, decompiling && dumping.")
+    parser.add_argument("-c", "--corpus", action="append", default=None, choices=list(CORPORA), help="only run these corpora")
+    parser.add_argument("-s", "--stage", action="append", default=None, choices=STAGES, help="only time these stages")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of every corpus")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs per stage (the median is compared)")
+    parser.add_argument("-o", "--out", default=None, help="save the results to this json file")
+    parser.add_argument("-b", "--baseline", default=None, help="compare against results saved with --out")
+    parser.add_argument("-t", "--threshold", type=float, default=0.10, help="slowdown that counts as a regression (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    log = lambda line: print(line, file=sys.stderr)
+    results = runBenchmarks(args.corpus, args.scale, args.repeat, args.stage or STAGES, log)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compareResults(results, baseline, args.threshold)
+        for name, stage, before, after, ratio in regressions:
+            print("REGRESSION %s/%s: %.4fs -> %.4fs (%.0f%% slower)" % (name, stage, before, after, (ratio - 1.0) * 100), file=sys.stderr)
+
+        if len(regressions) > 0:
+            return 1
+
+        print("no regressions against %s" % args.baseline, file=sys.stderr)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+'''
+    client.py
+
+    Depends on server.py (running somewhere).
+
+    A small client for the decompilation service. Keeps one connection open, so a tool can send request after
+    request without reconnecting.
+'''
+
+import argparse
+import http.client
+import json
+import socket
+import sys
+
+DEFAULT_PORT = 8151 # see server.py
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+class DecompClient:
+    # talks to [unix] if given, otherwise to [host]:[port]
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, unix: str = None, timeout: float = 60.0):
+        if unix is not None:
+            self.conn = _UnixConnection(unix, timeout)
+        else:
+            self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # returns (status, json payload)
+    def request(self, method: str, url: str, body: bytes = None) -> tuple[int, dict]:
+        headers = {"Content-Type": "application/octet-stream"} if body is not None else {}
+
+        try:
+            self.conn.request(method, url, body, headers)
+            response = self.conn.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            # the server closed our keep-alive connection, try once more on a fresh one
+            self.conn.close()
+            self.conn.request(method, url, body, headers)
+            response = self.conn.getresponse()
+
+        payload = json.loads(response.read() or b"{}")
+        if response.getheader("Connection", "").lower() == "close":
+            self.conn.close()
+
+        return response.status, payload
+
+    # decompiles the dump [bytecode], returns {output name: text}. [emit] picks the outputs (see batch.EMITTERS)
+    def decompile(self, bytecode: bytes, emit: list[str] = ("lua",)) -> dict[str, str]:
+        status, payload = self.request("POST", "/decompile?emit=" + ",".join(emit), bytes(bytecode))
+        if status != 200:
+            raise Exception("Decompilation failed! [%d: %s]" % (status, payload.get("error")))
+
+        return payload["outputs"]
+
+    def stats(self) -> dict:
+        return self.request("GET", "/stats")[1]
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Decompile Lua 5.1 dumps through a running server.py.")
+    parser.add_argument("inputs", nargs="*", help="dump files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-u", "--unix", default=None, help="connect to this unix socket instead")
+    parser.add_argument("-e", "--emit", default="lua", help="comma separated outputs to print (lua, dis, tsv, jsonl)")
+    parser.add_argument("--stats", action="store_true", help="print the server's counters")
+    args = parser.parse_args(argv)
+
+    emit = [e for e in args.emit.split(",") if e]
+    failures = 0
+
+    with DecompClient(args.host, args.port, args.unix) as client:
+        for path in args.inputs:
+            with open(path, 'rb') as f:
+                bytecode = f.read()
+
+            try:
+                outputs = client.decompile(bytecode, emit)
+            except Exception as e:
+                print("%s: %s" % (path, e), file=sys.stderr)
+                failures += 1
+                continue
+
+            for name in emit:
+                print(outputs[name])
+
+        if args.stats:
+            print(json.dumps(client.stats(), indent=2))
+
+    return 1 if failures > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
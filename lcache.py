@@ -0,0 +1,323 @@
+'''
+    lcache.py
+
+    Depends on lundump.py.
+
+    Content-addressed caching for decompiled protos. Protos are keyed by a digest of everything that can change their
+    decompiled output (instructions, constants, debug info && their child protos), so identical library functions
+    compiled into many dumps are only ever decompiled once. Entries are kept in an in-memory LRU, optionally backed by
+    a size-capped directory on disk that can be shared between runs (and processes).
+
+    Also snapshots whole parsed Chunk trees on disk (see SnapshotCache), keyed by the digest of the dump they came
+    from, so re-runs over unchanged dumps skip parsing entirely.
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import weakref
+from collections import OrderedDict
+
+from lundump import Chunk, ConstType, LuaUndump
+
+# bump this whenever the decompiler's output changes, so stale entries are never reused
+CACHE_VERSION = 4
+
+# protos are immutable once loaded, so remember digests we've already computed (nested protos get asked about once
+# per level of nesting otherwise)
+_digests = weakref.WeakKeyDictionary()
+
+def _hashConstant(h, constant):
+    h.update(struct.pack('<B', constant.type))
+
+    if constant.type == ConstType.STRING:
+        # raw (bytes) strings are shown differently than decoded ones, so they can't share a digest even when
+        # their bytes match
+        data = constant.data
+        if isinstance(data, (bytes, bytearray)):
+            h.update(b'b')
+        else:
+            h.update(b's')
+            data = data.encode('utf-8', 'surrogatepass')
+        h.update(struct.pack('<Q', len(data)))
+        h.update(data)
+    elif constant.type == ConstType.NUMBER:
+        h.update(struct.pack('<d', constant.data))
+    elif constant.type == ConstType.BOOL:
+        h.update(struct.pack('<B', 1 if constant.data else 0))
+
+def _hashString(h, string: str):
+    data = string.encode('utf-8', 'surrogatepass')
+    h.update(struct.pack('<Q', len(data)))
+    h.update(data)
+
+# hex digest of a proto && all of its children
+def protoDigest(chunk: Chunk) -> str:
+    if chunk in _digests:
+        return _digests[chunk]
+
+    h = hashlib.sha256()
+    h.update(struct.pack('<IBBBB', CACHE_VERSION, chunk.numParams, chunk.numUpvals, 1 if chunk.isVarg else 0,
+                         chunk.maxStack))
+
+    # instructions
+    instrs = chunk.instructions
+    h.update(struct.pack('<I', len(instrs)))
+    for column in (instrs.opcodes, instrs.A, instrs.B, instrs.C):
+        h.update(column.tobytes())
+
+    # constants
+    h.update(struct.pack('<I', len(chunk.constants)))
+    for constant in chunk.constants:
+        _hashConstant(h, constant)
+
+    # debug info that shows up in the output
+    h.update(struct.pack('<I', len(chunk.locals)))
+    for l in chunk.locals:
+        _hashString(h, l.name)
+        h.update(struct.pack('<II', l.start, l.end))
+
+    h.update(struct.pack('<I', len(chunk.upvalues)))
+    for u in chunk.upvalues:
+        _hashString(h, u)
+
+    # child protos
+    h.update(struct.pack('<I', len(chunk.protos)))
+    for p in chunk.protos:
+        h.update(bytes.fromhex(protoDigest(p)))
+
+    digest = h.hexdigest()
+    _digests[chunk] = digest
+    return digest
+
+# returns (mtime, path, size) for every [suffix] entry in a cache [directory] (entries are sharded into
+# subdirectories by the first 2 characters of their key)
+def _diskEntries(directory: str, suffix: str) -> list[tuple]:
+    entries = []
+
+    for sub in os.scandir(directory):
+        if not sub.is_dir():
+            continue
+
+        for entry in os.scandir(sub.path):
+            if entry.name.endswith(suffix):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError: # evicted by another process
+                    continue
+                entries.append((st.st_mtime, entry.path, st.st_size))
+
+    return entries
+
+# removes the least recently used entries until [directory] is back under [maxBytes]. returns the new size
+def _evictDisk(directory: str, suffix: str, diskBytes: int, maxBytes: int) -> int:
+    if diskBytes <= maxBytes:
+        return diskBytes
+
+    # another process may share this directory, so recount from what's actually there
+    entries = sorted(_diskEntries(directory, suffix))
+    diskBytes = sum(size for _, _, size in entries)
+
+    for _, path, size in entries:
+        if diskBytes <= maxBytes:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        diskBytes -= size
+
+    return diskBytes
+
+# writes [data] to [path] through a temp file, so readers never see a half written entry
+def _atomicWrite(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+class DecompCache:
+    # [maxEntries] caps the in-memory LRU. if [directory] is given, entries are also persisted there as json, && the
+    # least recently used files are evicted once the directory grows past [maxBytes]
+    def __init__(self, maxEntries: int = 4096, directory: str = None, maxBytes: int = 256 * 1024 * 1024):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.diskBytes = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.diskBytes = sum(size for _, _, size in _diskEntries(self.directory, ".json"))
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def __remember(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def __evictDisk(self):
+        self.diskBytes = _evictDisk(self.directory, ".json", self.diskBytes, self.maxBytes)
+
+    def get(self, key: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None:
+            path = self.__path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+
+                os.utime(path) # mark as recently used
+                self.__remember(key, value)
+                self.hits += 1
+                return value
+            except (OSError, ValueError): # missing, or a partial/corrupt entry
+                pass
+
+        self.misses += 1
+        return None
+
+    # [value] has to be json serializable if this cache is backed by a directory
+    def put(self, key: str, value):
+        self.__remember(key, value)
+
+        if self.directory is None:
+            return
+
+        path = self.__path(key)
+        _atomicWrite(path, json.dumps(value).encode('utf-8'))
+
+        self.diskBytes += os.path.getsize(path)
+        self.__evictDisk()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "diskBytes": self.diskBytes}
+
+# bump this whenever Chunk (or anything it holds) changes shape, so old snapshots are never unpickled into new code
+SNAPSHOT_VERSION = 1
+
+_SNAPSHOT_MAGIC = b"LDSNAP"
+
+# a size-capped directory of parsed Chunk trees, keyed by the sha256 of the dump they were parsed from (plus
+# SNAPSHOT_VERSION && the loader's options). snapshots are pickles, so only point this at directories you trust
+class SnapshotCache:
+    def __init__(self, directory: str, maxBytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.diskBytes = sum(size for _, _, size in _diskEntries(self.directory, ".snap"))
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".snap")
+
+    @staticmethod
+    def key(bytecode, stringEncoding: str = 'latin-1', lazyStrings: bool = False) -> str:
+        h = hashlib.sha256()
+        h.update(struct.pack('<I', SNAPSHOT_VERSION))
+        _hashString(h, "%s:%s" % (stringEncoding, lazyStrings))
+        h.update(bytecode)
+        return h.hexdigest()
+
+    # the snapshot stored under [key], or None. broken or mismatched snapshots are removed
+    def get(self, key: str) -> Chunk:
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        header = _SNAPSHOT_MAGIC + struct.pack('<I', SNAPSHOT_VERSION) + bytes.fromhex(key)
+        try:
+            if not data.startswith(header):
+                raise ValueError("stale snapshot")
+
+            chunk = pickle.loads(memoryview(data)[len(header):])
+            if not isinstance(chunk, Chunk):
+                raise ValueError("not a chunk")
+        except Exception:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            self.misses += 1
+            return None
+
+        os.utime(path) # mark as recently used
+        self.hits += 1
+        return chunk
+
+    def put(self, key: str, chunk: Chunk) -> None:
+        header = _SNAPSHOT_MAGIC + struct.pack('<I', SNAPSHOT_VERSION) + bytes.fromhex(key)
+        path = self.__path(key)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        _atomicWrite(path, header + pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL))
+
+        self.diskBytes += os.path.getsize(path) - replaced
+        self.diskBytes = _evictDisk(self.directory, ".snap", self.diskBytes, self.maxBytes)
+
+    # parses the dump at [path] with [undump] (a LuaUndump, which sets the string options), unless a snapshot of
+    # the same bytes is already cached
+    def loadFile(self, path: str, undump: LuaUndump = None) -> Chunk:
+        undump = undump or LuaUndump()
+
+        with open(path, 'rb') as f:
+            try:
+                bytecode = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty files can't be mapped
+                bytecode = f.read()
+
+        try:
+            key = self.key(bytecode, undump.stringEncoding, undump.lazyStrings)
+            chunk = self.get(key)
+            if chunk is None:
+                chunk = undump.decode_rawbytecode(bytecode)
+                self.put(key, chunk)
+        finally:
+            if isinstance(undump.bytecode, memoryview):
+                undump.bytecode.release()
+            undump.bytecode = None
+
+            if isinstance(bytecode, mmap.mmap):
+                bytecode.close()
+
+        return chunk
+
+    def clear(self) -> None:
+        for _, path, _ in _diskEntries(self.directory, ".snap"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self.diskBytes = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "diskBytes": self.diskBytes}
@@ -0,0 +1,334 @@
+'''
+    lcfg.py
+
+    Depends on lundump.py.
+
+    Builds control flow graphs for protos: the instructions are split into basic blocks, linked by the edges of every
+    branching instruction, && dominator/post-dominator trees are computed over them with Lengauer-Tarjan. Graphs
+    are cached per proto (see getCFG()), so the disassembler, decompiler && any other analysis share one computation,
+    && each part of a graph is only built once something asks for it.
+'''
+
+import array
+import weakref
+
+from lundump import Chunk, Opcodes, InstructionList
+
+_JmpInstr = [Opcodes.JMP, Opcodes.FORPREP, Opcodes.FORLOOP]
+
+# conditional tests skip the next instruction (always a JMP) when they fail
+_CondInstr = [Opcodes.EQ, Opcodes.LT, Opcodes.LE, Opcodes.TEST, Opcodes.TESTSET, Opcodes.TFORLOOP]
+
+# PCs control can flow to after the instruction at [pc]. targets past the end of the proto are dropped
+def instrSuccessors(instrs: InstructionList, pc: int) -> list[int]:
+    opcode = instrs.opcodes[pc]
+    succs = []
+
+    if opcode == Opcodes.JMP or opcode == Opcodes.FORPREP:
+        succs = [pc + 1 + instrs.B[pc]]
+    elif opcode == Opcodes.FORLOOP:
+        succs = [pc + 1 + instrs.B[pc], pc + 1]
+    elif opcode in _CondInstr:
+        succs = [pc + 1, pc + 2]
+    elif opcode == Opcodes.LOADBOOL and instrs.C[pc] != 0: # LOADBOOL can skip the next instruction too
+        succs = [pc + 2]
+    elif opcode == Opcodes.RETURN:
+        succs = []
+    else:
+        succs = [pc + 1]
+
+    return [s for s in succs if 0 <= s < len(instrs)]
+
+class BasicBlock:
+    __slots__ = ('index', 'startPC', 'endPC', 'succs', 'preds')
+
+    def __init__(self, index: int, startPC: int, endPC: int):
+        self.index = index
+        self.startPC = startPC
+        self.endPC = endPC # inclusive
+        self.succs: list[int] = [] # block indexes
+        self.preds: list[int] = []
+
+# returns the immediate dominator of every node (-1 for [entry] && anything unreachable from it) using the simple
+# version of Lengauer-Tarjan, with path compression
+def _dominators(numNodes: int, succs: list[list[int]], preds: list[list[int]], entry: int) -> list[int]:
+    dfnum = [-1] * numNodes
+    vertex = []
+    parent = [-1] * numNodes
+
+    # number the nodes in DFS preorder
+    stack = [(entry, -1)]
+    while len(stack) > 0:
+        v, p = stack.pop()
+        if dfnum[v] != -1:
+            continue
+
+        dfnum[v] = len(vertex)
+        vertex.append(v)
+        parent[v] = p
+        for w in reversed(succs[v]):
+            if dfnum[w] == -1:
+                stack.append((w, v))
+
+    semi = dfnum[:]
+    label = list(range(numNodes))
+    ancestor = [-1] * numNodes
+    idom = [-1] * numNodes
+    bucket = [[] for _ in range(numNodes)]
+
+    def evaluate(v: int) -> int:
+        if ancestor[v] == -1:
+            return v
+
+        # compress the path from v up to the root of its tree in the forest
+        path = []
+        u = v
+        while ancestor[ancestor[u]] != -1:
+            path.append(u)
+            u = ancestor[u]
+
+        for u in reversed(path):
+            a = ancestor[u]
+            if semi[label[a]] < semi[label[u]]:
+                label[u] = label[a]
+            ancestor[u] = ancestor[a]
+
+        return label[v]
+
+    for i in range(len(vertex) - 1, 0, -1):
+        w = vertex[i]
+
+        for v in preds[w]:
+            if dfnum[v] == -1: # unreachable
+                continue
+
+            u = evaluate(v)
+            if semi[u] < semi[w]:
+                semi[w] = semi[u]
+
+        bucket[vertex[semi[w]]].append(w)
+        ancestor[w] = parent[w]
+
+        for v in bucket[parent[w]]:
+            u = evaluate(v)
+            idom[v] = u if semi[u] < semi[v] else parent[w]
+        bucket[parent[w]] = []
+
+    for i in range(1, len(vertex)):
+        w = vertex[i]
+        if idom[w] != vertex[semi[w]]:
+            idom[w] = idom[idom[w]]
+
+    return idom
+
+# numbers the tree given by [idom] so ancestor checks are O(1). returns (pre, post), -1 for nodes not in the tree
+def _numberTree(idom: list[int], root: int) -> tuple[list[int], list[int]]:
+    children = [[] for _ in idom]
+    for v, d in enumerate(idom):
+        if d != -1:
+            children[d].append(v)
+
+    pre = [-1] * len(idom)
+    post = [-1] * len(idom)
+    counter = 0
+    stack = [(root, False)]
+    while len(stack) > 0:
+        v, done = stack.pop()
+        if done:
+            post[v] = counter
+            counter += 1
+            continue
+
+        pre[v] = counter
+        counter += 1
+        stack.append((v, True))
+        for c in children[v]:
+            stack.append((c, False))
+
+    return pre, post
+
+# everything but the jump targets (all the decompiler needs) is only computed the first time something asks for it:
+# blocks (&& succPCs, blockOf), then the dominator tree, the post-dominator tree && the reverse postorder
+class CFG:
+    def __init__(self, chunk: Chunk):
+        instrs = chunk.instructions
+        self.instrs = instrs
+        ops, Bs = instrs.opcodes, instrs.B
+        self.jumps: dict[int, int] = {pc: pc + 1 + Bs[pc] for pc in range(len(ops)) if ops[pc] in _JmpInstr}
+
+        self._blocks: list[BasicBlock] = None
+        self._dom: tuple = None # (idom, domPre, domPost)
+        self._pdom: tuple = None # (ipdom, pdomPre, pdomPost)
+        self._rpo: list[int] = None
+
+    def __buildBlocks(self) -> None:
+        instrs = self.instrs
+        numInstrs = len(instrs)
+        self._succPCs: list[list[int]] = [instrSuccessors(instrs, pc) for pc in range(numInstrs)]
+
+        # find the leaders (first instruction of each block)
+        leaders = [False] * numInstrs
+        if numInstrs > 0:
+            leaders[0] = True
+
+        for pc in range(numInstrs):
+            succs = self._succPCs[pc]
+            if succs != [pc + 1]: # anything that doesn't just fall through ends its block
+                for s in succs:
+                    leaders[s] = True
+                if pc + 1 < numInstrs:
+                    leaders[pc + 1] = True
+
+        # split into blocks
+        blocks = []
+        self._blockOf = array.array('i', [0] * numInstrs) # pc -> block index
+        for pc in range(numInstrs):
+            if leaders[pc]:
+                if len(blocks) > 0:
+                    blocks[len(blocks) - 1].endPC = pc - 1
+                blocks.append(BasicBlock(len(blocks), pc, numInstrs - 1))
+            self._blockOf[pc] = len(blocks) - 1
+
+        # link them
+        for block in blocks:
+            for s in self._succPCs[block.endPC]:
+                target = self._blockOf[s]
+                if target not in block.succs:
+                    block.succs.append(target)
+                    blocks[target].preds.append(block.index)
+
+        self._blocks = blocks
+
+    @property
+    def blocks(self) -> list[BasicBlock]:
+        if self._blocks is None:
+            self.__buildBlocks()
+
+        return self._blocks
+
+    @property
+    def succPCs(self) -> list[list[int]]:
+        self.blocks
+        return self._succPCs
+
+    @property
+    def blockOf(self) -> array.array:
+        self.blocks
+        return self._blockOf
+
+    def __dominators(self) -> tuple:
+        if self._dom is None:
+            blocks = self.blocks
+            if len(blocks) == 0:
+                self._dom = ([], [], [])
+            else:
+                idom = _dominators(len(blocks), [b.succs for b in blocks], [b.preds for b in blocks], 0)
+                self._dom = (idom,) + _numberTree(idom, 0)
+
+        return self._dom
+
+    # post-dominators, over the reversed graph with a virtual exit node that every returning block flows into
+    def __postDominators(self) -> tuple:
+        if self._pdom is None:
+            blocks = self.blocks
+            numBlocks = len(blocks)
+            succs = [b.succs for b in blocks]
+            preds = [b.preds for b in blocks]
+
+            exit = numBlocks
+            rsuccs = preds + [[b.index for b in blocks if len(b.succs) == 0]]
+            rpreds = [s + ([exit] if len(s) == 0 else []) for s in succs] + [[]]
+            ipdom = _dominators(numBlocks + 1, rsuccs, rpreds, exit)
+            self._pdom = ([-1 if d == exit else d for d in ipdom[:numBlocks]],) + _numberTree(ipdom, exit)
+
+        return self._pdom
+
+    @property
+    def idom(self) -> list[int]:
+        return self.__dominators()[0]
+
+    @property
+    def domPre(self) -> list[int]:
+        return self.__dominators()[1]
+
+    @property
+    def domPost(self) -> list[int]:
+        return self.__dominators()[2]
+
+    @property
+    def ipdom(self) -> list[int]:
+        return self.__postDominators()[0]
+
+    @property
+    def pdomPre(self) -> list[int]:
+        return self.__postDominators()[1]
+
+    @property
+    def pdomPost(self) -> list[int]:
+        return self.__postDominators()[2]
+
+    # reverse postorder of the reachable blocks
+    @property
+    def rpo(self) -> list[int]:
+        if self._rpo is None:
+            self._rpo = self.__reversePostorder()
+
+        return self._rpo
+
+    def __reversePostorder(self) -> list[int]:
+        if len(self.blocks) == 0:
+            return []
+
+        order = []
+        seen = [False] * len(self.blocks)
+        seen[0] = True
+        stack = [(0, iter(self.blocks[0].succs))]
+        while len(stack) > 0:
+            v, it = stack[len(stack) - 1]
+            for w in it:
+                if not seen[w]:
+                    seen[w] = True
+                    stack.append((w, iter(self.blocks[w].succs)))
+                    break
+            else:
+                order.append(v)
+                stack.pop()
+
+        order.reverse()
+        return order
+
+    def blockAt(self, pc: int) -> BasicBlock:
+        return self.blocks[self._blockOf[pc]]
+
+    # where the JMP/FORPREP/FORLOOP at [pc] jumps to, or None if it isn't a jump
+    def jumpTarget(self, pc: int) -> int:
+        return self.jumps.get(pc)
+
+    # does block [a] dominate block [b]? (every block dominates itself)
+    def dominates(self, a: int, b: int) -> bool:
+        _, pre, post = self.__dominators()
+        if pre[a] == -1 or pre[b] == -1:
+            return False
+
+        return pre[a] <= pre[b] and post[b] <= post[a]
+
+    # does block [a] post-dominate block [b]?
+    def postDominates(self, a: int, b: int) -> bool:
+        _, pre, post = self.__postDominators()
+        if pre[a] == -1 or pre[b] == -1:
+            return False
+
+        return pre[a] <= pre[b] and post[b] <= post[a]
+
+    # an edge is a back edge (ie. a loop) if its target dominates its source
+    def isBackEdge(self, fromBlock: int, toBlock: int) -> bool:
+        return self.dominates(toBlock, fromBlock)
+
+# CFGs are cached for as long as their proto is alive
+_cfgs = weakref.WeakKeyDictionary()
+
+def getCFG(chunk: Chunk) -> CFG:
+    if chunk not in _cfgs:
+        _cfgs[chunk] = CFG(chunk)
+
+    return _cfgs[chunk]
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+'''
+    lconvert.py
+
+    Depends on lundump.py.
+
+    Re-targets dumps to a different header profile (byte order, int/size_t/lua_Number sizes, integral numbers). The
+    dump is streamed field by field from the source straight into the target encoding, without ever building
+    Chunks, so huge dumps convert in about [bufferSize] bytes of memory. Instruction words && line numbers are
+    converted a block at a time.
+'''
+
+import argparse
+import array
+import io
+import os
+import sys
+import tempfile
+
+from lundump import (LuaUndump, HeaderProfile, PROFILES, _LUAMAGIC, _INT_TYPECODES, _STREAM_BUFFER_SIZE,
+                     _uintStruct, _numberStruct, _toNumber)
+
+class LuaConverter(LuaUndump):
+    def __init__(self, target: HeaderProfile, bufferSize: int = _STREAM_BUFFER_SIZE):
+        super().__init__()
+        self.target = target
+        self.bufferSize = bufferSize
+        self.protos = 0
+
+        if target.instr_size != 4:
+            raise Exception("Unsupported instruction size! [%d]" % target.instr_size)
+
+        if target.int_size not in _INT_TYPECODES:
+            raise Exception("Unsupported integer size! [%d]" % target.int_size)
+
+        order = '>' if target.big_endian else '<'
+        self._tUint = _uintStruct(order, target.int_size)
+        self._tSizet = _uintStruct(order, target.size_t)
+        self._tNumber = _numberStruct(order, target.l_number_size, target.integral_flag)
+        self._tSwap = target.big_endian != (sys.byteorder == 'big')
+
+        self._out = None
+        self._outBuf = bytearray()
+
+    # ========================================[[ Output ]]=========================================
+
+    def _emit(self, data) -> None:
+        self._outBuf += data
+
+        if len(self._outBuf) >= self.bufferSize:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._out.write(self._outBuf)
+        self._outBuf = bytearray()
+
+    def _emitStruct(self, packer, val) -> None:
+        try:
+            self._emit(packer.pack(val))
+        except Exception:
+            raise Exception("Value doesn't fit the target profile! [%s]" % val)
+
+    # writes an array of host ints in the target's byte order
+    def _emitArray(self, data: array.array) -> None:
+        if self._tSwap:
+            data.byteswap()
+
+        self._emit(memoryview(data).cast('B'))
+
+    # ========================================[[ Fields ]]=========================================
+
+    def _copyByte(self) -> int:
+        b = self._get_byte()
+        self._outBuf.append(b)
+        return b
+
+    def _copyUint(self) -> int:
+        val = self._get_uint()
+        self._emitStruct(self._tUint, val)
+        return val
+
+    # NULL strings (size 0) stay NULL
+    def _copyString(self) -> None:
+        size = self._get_size_t()
+        self._emitStruct(self._tSizet, size)
+
+        if size > 0:
+            self._emit(self._loadBlock(size))
+
+    def _copyNumber(self) -> None:
+        num = self._get_double()
+        self._emitStruct(self._tNumber, _toNumber(num, self.target.integral_flag))
+
+    def _copyHeader(self) -> None:
+        if not bytes(self._loadBlock(4)) == _LUAMAGIC:
+            raise Exception("Lua Bytecode expected!")
+
+        self._decode_header()
+
+        t = self.target
+        self._emit(_LUAMAGIC)
+        self._emit(bytes((self.vm_version, self.bytecode_format, 0 if t.big_endian else 1, t.int_size, t.size_t,
+                          t.instr_size, t.l_number_size, 1 if t.integral_flag else 0)))
+
+    # mirrors LuaUndump.decode_chunk(), field for field
+    def _copyChunk(self) -> None:
+        self.protos += 1
+
+        # meta info (source, line defined, last line defined, then numUpvals, numParams, is_vararg && maxStack)
+        self._copyString()
+        self._copyUint()
+        self._copyUint()
+        self._emit(self._loadBlock(4))
+
+        # instructions
+        num = self._copyUint()
+        self._emitArray(self._get_instr_block(num))
+
+        # constants
+        num = self._copyUint()
+        for i in range(num):
+            type = self._copyByte()
+
+            if type == 1: # bool
+                self._copyByte()
+            elif type == 3: # number
+                self._copyNumber()
+            elif type == 4: # string
+                self._copyString()
+            elif type != 0:
+                raise Exception("Unknown Datatype! [%d]" % type)
+
+        # protos
+        num = self._copyUint()
+        for i in range(num):
+            self._copyChunk()
+
+        # line numbers
+        num = self._copyUint()
+        lines = self._get_int_block(num)
+        if lines.typecode != _INT_TYPECODES[self.target.int_size]:
+            lines = array.array(_INT_TYPECODES[self.target.int_size], lines)
+        self._emitArray(lines)
+
+        # locals
+        num = self._copyUint()
+        for i in range(num):
+            self._copyString()
+            self._copyUint()
+            self._copyUint()
+
+        # upvalues
+        num = self._copyUint()
+        for i in range(num):
+            self._copyString()
+
+    # converts the dump read from the binary file object [src], writing it to [dst]. returns the source's profile
+    def convert(self, src, dst) -> HeaderProfile:
+        self._stream = src
+        self._out = dst
+        self.bytecode = memoryview(b"")
+        self.index = 0
+        self.protos = 0
+
+        try:
+            self._copyHeader()
+            self._copyChunk()
+            self._flush()
+        finally:
+            self._stream = None
+            self._out = None
+            self.bytecode = None
+            self._outBuf = bytearray()
+
+        return self.getProfile()
+
+def convertBytes(bytecode: bytes, target: HeaderProfile) -> bytes:
+    out = io.BytesIO()
+    LuaConverter(target).convert(io.BytesIO(bytecode), out)
+
+    return out.getvalue()
+
+# converts the dump at [src] into [dst] (which can be the same file). the output is written to a temp file first,
+# so a failed conversion never leaves a partial dump behind. returns the source's profile
+def convertFile(src: str, dst: str, target: HeaderProfile, bufferSize: int = _STREAM_BUFFER_SIZE) -> HeaderProfile:
+    directory = os.path.dirname(os.path.abspath(dst))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with open(src, 'rb') as inFile, os.fdopen(fd, 'wb') as outFile:
+            profile = LuaConverter(target, bufferSize).convert(inFile, outFile)
+
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    return profile
+
+# builds a profile from a named one ([name], defaults to x64) with any of the fields overridden
+def makeProfile(name: str = None, **overrides) -> HeaderProfile:
+    if name is not None and name not in PROFILES:
+        raise Exception("Unknown profile! [%s]" % name)
+
+    profile = HeaderProfile.of(PROFILES[name or "x64"])
+    for field, val in overrides.items():
+        if val is not None:
+            setattr(profile, field, val)
+
+    return profile
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-target Lua 5.1 dumps to another byte order or data sizes.")
+    parser.add_argument("input", help="dump file")
+    # never overwrite the input unless asked to
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("-o", "--out", default=None, help="output file")
+    output.add_argument("--in-place", action="store_true", help="overwrite the input with the converted dump")
+    parser.add_argument("-p", "--profile", default=None, help="target profile (%s)" % ", ".join(PROFILES))
+    parser.add_argument("--endian", choices=["little", "big"], default=None)
+    parser.add_argument("--int-size", type=int, default=None)
+    parser.add_argument("--size-t", type=int, default=None)
+    parser.add_argument("--number-size", type=int, default=None)
+    parser.add_argument("--integral", choices=["yes", "no"], default=None, help="is lua_Number an integer type?")
+    args = parser.parse_args(argv)
+
+    try:
+        target = makeProfile(args.profile, big_endian=None if args.endian is None else args.endian == "big",
+                             int_size=args.int_size, size_t=args.size_t, l_number_size=args.number_size,
+                             integral_flag=None if args.integral is None else args.integral == "yes")
+    except Exception as e:
+        parser.error(str(e))
+
+    source = convertFile(args.input, args.input if args.in_place else args.out, target)
+    print("%s: %r -> %r" % (args.input, source, target), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
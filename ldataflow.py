@@ -0,0 +1,267 @@
+'''
+    ldataflow.py
+
+    Depends on lundump.py && lcfg.py.
+
+    Dataflow analysis over a proto's control flow graph. Register sets are plain int bitmasks (a Lua 5.1 function
+    has at most 250 registers), and problems are solved with a worklist seeded in reverse postorder (postorder for
+    backwards problems). Provides liveness && reaching definitions (with def-use chains on top of them).
+'''
+
+from collections import deque
+
+from lundump import Chunk, Opcodes, whichRK
+from lcfg import CFG, getCFG
+
+# bitmask of registers [start] to [end] (inclusive)
+def _regRange(start: int, end: int) -> int:
+    if end < start:
+        return 0
+
+    return ((1 << (end - start + 1)) - 1) << start
+
+def _rk(rk: int) -> int:
+    return 0 if whichRK(rk) else (1 << rk)
+
+# returns (defs, uses) register masks for every instruction in [chunk]. for instructions that run up to the top of
+# the stack (B or C of 0), we assume the whole frame
+def instrDefsUses(chunk: Chunk) -> tuple[list[int], list[int]]:
+    instrs = chunk.instructions
+    top = max(chunk.maxStack - 1, 0)
+    defs = [0] * len(instrs)
+    uses = [0] * len(instrs)
+
+    pc = 0
+    while pc < len(instrs):
+        op, A, B, C = instrs.opcodes[pc], instrs.A[pc], instrs.B[pc], instrs.C[pc]
+        d, u = 0, 0
+
+        match op:
+            case Opcodes.MOVE | Opcodes.UNM | Opcodes.NOT | Opcodes.LEN:
+                d, u = 1 << A, 1 << B
+            case Opcodes.LOADK | Opcodes.LOADBOOL | Opcodes.GETUPVAL | Opcodes.GETGLOBAL | Opcodes.NEWTABLE:
+                d = 1 << A
+            case Opcodes.LOADNIL:
+                d = _regRange(A, B)
+            case Opcodes.GETTABLE:
+                d, u = 1 << A, (1 << B) | _rk(C)
+            case Opcodes.SETGLOBAL | Opcodes.SETUPVAL | Opcodes.TEST:
+                u = 1 << A
+            case Opcodes.SETTABLE:
+                u = (1 << A) | _rk(B) | _rk(C)
+            case Opcodes.SELF:
+                d, u = _regRange(A, A + 1), (1 << B) | _rk(C)
+            case Opcodes.ADD | Opcodes.SUB | Opcodes.MUL | Opcodes.DIV | Opcodes.MOD | Opcodes.POW:
+                d, u = 1 << A, _rk(B) | _rk(C)
+            case Opcodes.CONCAT:
+                d, u = 1 << A, _regRange(B, C)
+            case Opcodes.EQ | Opcodes.LT | Opcodes.LE:
+                u = _rk(B) | _rk(C)
+            case Opcodes.TESTSET:
+                d, u = 1 << A, 1 << B
+            case Opcodes.CALL | Opcodes.TAILCALL:
+                u = _regRange(A, A + B - 1 if B > 0 else top)
+                d = _regRange(A, A + C - 2 if C > 0 else top)
+            case Opcodes.RETURN:
+                u = _regRange(A, A + B - 2 if B > 0 else top)
+            case Opcodes.FORLOOP:
+                d, u = (1 << A) | (1 << (A + 3)), _regRange(A, A + 2)
+            case Opcodes.FORPREP:
+                d, u = 1 << A, _regRange(A, A + 2)
+            case Opcodes.TFORLOOP:
+                d, u = _regRange(A + 2, A + 2 + C), _regRange(A, A + 2)
+            case Opcodes.SETLIST:
+                u = _regRange(A, A + B if B > 0 else top)
+            case Opcodes.VARARG:
+                d = _regRange(A, A + B - 2 if B > 0 else top)
+            case Opcodes.CLOSURE:
+                d = 1 << A
+
+                # the next numUpvals instructions are pseudo-instructions telling the closure where to find its
+                # upvalues. they're never executed, a MOVE here only reads its B
+                numUpvals = chunk.protos[B].numUpvals if B < len(chunk.protos) else 0
+                for i in range(numUpvals):
+                    if pc + 1 + i < len(instrs) and instrs.opcodes[pc + 1 + i] == Opcodes.MOVE:
+                        uses[pc + 1 + i] = 1 << instrs.B[pc + 1 + i]
+
+                defs[pc], uses[pc] = d, u
+                pc += 1 + numUpvals
+                continue
+
+        defs[pc], uses[pc] = d, u
+        pc += 1
+
+    return defs, uses
+
+# solves a dataflow problem over [cfg] with a worklist. [transfer](block, inSet) -> outSet is applied to every block,
+# && block inputs are the OR of their predecessors' outputs (or successors', if [forward] is false). returns
+# (ins, outs) where, for backwards problems, 'in' is the set at the end of the block
+def solve(cfg: CFG, transfer, forward: bool = True) -> tuple[list[int], list[int]]:
+    numBlocks = len(cfg.blocks)
+    ins = [0] * numBlocks
+    outs = [0] * numBlocks
+
+    order = cfg.rpo if forward else list(reversed(cfg.rpo))
+    worklist = deque(order)
+    queued = [False] * numBlocks
+    for b in order:
+        queued[b] = True
+
+    while len(worklist) > 0:
+        b = worklist.popleft()
+        queued[b] = False
+        block = cfg.blocks[b]
+
+        inSet = 0
+        for p in (block.preds if forward else block.succs):
+            inSet |= outs[p]
+        ins[b] = inSet
+
+        outSet = transfer(b, inSet)
+        if outSet != outs[b]:
+            outs[b] = outSet
+            for n in (block.succs if forward else block.preds):
+                if not queued[n]:
+                    queued[n] = True
+                    worklist.append(n)
+
+    return ins, outs
+
+class Liveness:
+    def __init__(self, chunk: Chunk, cfg: CFG = None, defsUses: tuple = None):
+        self.cfg = cfg or getCFG(chunk)
+        self.defs, self.uses = defsUses or instrDefsUses(chunk)
+
+        # summarize each block: registers it reads before writing, && registers it writes
+        self.blockUses = []
+        self.blockDefs = []
+        for block in self.cfg.blocks:
+            u, d = 0, 0
+            for pc in range(block.startPC, block.endPC + 1):
+                u |= self.uses[pc] & ~d
+                d |= self.defs[pc]
+            self.blockUses.append(u)
+            self.blockDefs.append(d)
+
+        self.liveOut, self.liveIn = solve(self.cfg, lambda b, out: self.blockUses[b] | (out & ~self.blockDefs[b]), forward=False)
+        self.__liveAfter = {}
+
+    # registers live right after the instruction at [pc] runs
+    def liveAfter(self, pc: int) -> int:
+        if pc not in self.__liveAfter:
+            block = self.cfg.blockAt(pc)
+            live = self.liveOut[block.index]
+            for p in range(block.endPC, block.startPC - 1, -1):
+                self.__liveAfter[p] = live
+                live = self.uses[p] | (live & ~self.defs[p])
+
+        return self.__liveAfter[pc]
+
+    def isLiveAfter(self, pc: int, reg: int) -> bool:
+        return (self.liveAfter(pc) >> reg) & 1 == 1
+
+class ReachingDefs:
+    def __init__(self, chunk: Chunk, cfg: CFG = None, defsUses: tuple = None):
+        self.cfg = cfg or getCFG(chunk)
+        self.defs, self.uses = defsUses or instrDefsUses(chunk)
+
+        # number every (pc, reg) definition, && group them by register so we know what each one kills
+        self.sites: list[tuple[int, int]] = []
+        self.siteOf: dict[tuple[int, int], int] = {}
+        regSites = {}
+        for pc in range(len(self.defs)):
+            d = self.defs[pc]
+            while d:
+                reg = (d & -d).bit_length() - 1
+                d &= d - 1
+
+                self.siteOf[(pc, reg)] = len(self.sites)
+                regSites[reg] = regSites.get(reg, 0) | (1 << len(self.sites))
+                self.sites.append((pc, reg))
+        self.regSites: dict[int, int] = regSites
+
+        self.blockGen = []
+        self.blockKill = []
+        for block in self.cfg.blocks:
+            gen, kill = 0, 0
+            for pc in range(block.startPC, block.endPC + 1):
+                g, k = self.__instrGenKill(pc)
+                gen = g | (gen & ~k)
+                kill = k | (kill & ~g)
+            self.blockGen.append(gen)
+            self.blockKill.append(kill)
+
+        self.reachIn, self.reachOut = solve(self.cfg, lambda b, inSet: self.blockGen[b] | (inSet & ~self.blockKill[b]))
+        self.__chains = None
+
+    def __instrGenKill(self, pc: int) -> tuple[int, int]:
+        gen, kill = 0, 0
+        d = self.defs[pc]
+        while d:
+            reg = (d & -d).bit_length() - 1
+            d &= d - 1
+
+            site = 1 << self.siteOf[(pc, reg)]
+            gen |= site
+            kill |= self.regSites[reg] & ~site
+
+        return gen, kill
+
+    # walks every block, recording which uses each definition reaches
+    def __buildChains(self) -> None:
+        self.__chains = [[] for _ in self.sites]
+
+        for block in self.cfg.blocks:
+            reaching = self.reachIn[block.index]
+            for pc in range(block.startPC, block.endPC + 1):
+                u = self.uses[pc]
+                while u:
+                    reg = (u & -u).bit_length() - 1
+                    u &= u - 1
+
+                    sites = reaching & self.regSites.get(reg, 0)
+                    while sites:
+                        site = (sites & -sites).bit_length() - 1
+                        sites &= sites - 1
+                        self.__chains[site].append(pc)
+
+                g, k = self.__instrGenKill(pc)
+                reaching = g | (reaching & ~k)
+
+    # PCs that read the value [reg] is given at [pc]
+    def usesOf(self, pc: int, reg: int) -> list[int]:
+        if (pc, reg) not in self.siteOf:
+            return []
+
+        if self.__chains is None:
+            self.__buildChains()
+
+        return self.__chains[self.siteOf[(pc, reg)]]
+
+    def useCount(self, pc: int, reg: int) -> int:
+        return len(self.usesOf(pc, reg))
+
+    # PCs of the definitions of [reg] that reach the instruction at [pc]
+    def defsReaching(self, pc: int, reg: int) -> list[int]:
+        block = self.cfg.blockAt(pc)
+        reaching = self.reachIn[block.index]
+        for p in range(block.startPC, pc):
+            g, k = self.__instrGenKill(p)
+            reaching = g | (reaching & ~k)
+
+        sites = reaching & self.regSites.get(reg, 0)
+        pcs = []
+        while sites:
+            site = (sites & -sites).bit_length() - 1
+            sites &= sites - 1
+            pcs.append(self.sites[site][0])
+
+        return pcs
+
+# both analyses for a proto, sharing the same cfg && per-instruction def/use sets
+class Dataflow:
+    def __init__(self, chunk: Chunk):
+        cfg = getCFG(chunk)
+        defsUses = instrDefsUses(chunk)
+        self.liveness = Liveness(chunk, cfg, defsUses)
+        self.reaching = ReachingDefs(chunk, cfg, defsUses)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+'''
+    lexport.py
+
+    Depends on lundump.py.
+
+    Machine-readable exports of a dump's protos, for loading into analytics jobs without scraping the disassembly.
+    Protos are streamed straight out of LuaUndump (children before their parents), so the whole tree never has to be
+    in memory. Two formats are supported:
+        - JSON Lines: one record per proto, constant, local, upvalue && instruction
+        - columns: a directory of typed binary arrays (one file per instruction column) plus a manifest.json with
+          the protos, constants, locals && upvalues. load them back with readColumns()
+'''
+
+import argparse
+import array
+import json
+import math
+import os
+import sys
+
+from lundump import Chunk, ConstType, InstructionType, LuaUndump, opInfo
+
+COLUMNS_VERSION = 2
+
+# (name, typecode) of every instruction column. line is -1 when the dump has no line info
+_COLUMNS = [
+    ("proto", 'I'), # index into the manifest's protos
+    ("pc", 'I'),
+    ("opcode", 'B'),
+    ("A", 'B'),
+    ("B", 'i'), # B, Bx or sBx
+    ("C", 'h'), # -1 for ABx && AsBx instructions, which have no C
+    ("line", 'i'),
+]
+
+# per opcode, whether the instruction has a C operand
+_HAS_C = [info.type == InstructionType.ABC for info in opInfo]
+
+# protos are identified by their path from the root, eg. "0.2.1" is the 2nd child of the root's 3rd child
+def protoPath(path: tuple) -> str:
+    return ".".join(["0"] + [str(i) for i in path])
+
+# walks an already loaded [chunk] in the same order LuaUndump streams it: (path, proto), children first
+def walkProtos(chunk: Chunk, path: tuple = ()):
+    for i, proto in enumerate(chunk.protos):
+        yield from walkProtos(proto, path + (i,))
+
+    yield path, chunk
+
+# json has no nan or infinity, so those numbers are written as the strings "NaN", "Infinity" && "-Infinity"
+def _constantValue(constant):
+    if constant.type == ConstType.STRING:
+        return constant.getText()
+    elif constant.type == ConstType.NUMBER and not math.isfinite(constant.data):
+        return "NaN" if math.isnan(constant.data) else ("Infinity" if constant.data > 0 else "-Infinity")
+
+    return constant.data
+
+def _protoRecord(path: str, chunk: Chunk) -> dict:
+    return {
+        "type": "proto", "proto": path, "name": str(chunk.name),
+        "firstLine": chunk.frst_line, "lastLine": chunk.last_line, "numUpvals": chunk.numUpvals,
+        "numParams": chunk.numParams, "isVarg": chunk.isVarg, "maxStack": chunk.maxStack,
+        "numInstrs": len(chunk.instructions), "numConstants": len(chunk.constants),
+    }
+
+# writes [protos] ((path, chunk) pairs, see walkProtos()) to the text stream [out] as JSON Lines
+def writeJSONL(protos, out, bufferSize: int = 1 << 16) -> int:
+    parts = []
+    size = 0
+    records = 0
+
+    def write(text: str):
+        nonlocal size, parts
+        parts.append(text)
+        size += len(text)
+        if size >= bufferSize:
+            out.write("".join(parts))
+            parts, size = [], 0
+
+    for path, chunk in protos:
+        path = protoPath(path)
+        jpath = json.dumps(path)
+
+        write(json.dumps(_protoRecord(path, chunk)) + "\n")
+
+        for i, constant in enumerate(chunk.constants):
+            write('{"type": "constant", "proto": %s, "index": %d, "kind": "%s", "value": %s}\n' % (
+                jpath, i, constant.type.name, json.dumps(_constantValue(constant), allow_nan=False)))
+
+        for i, l in enumerate(chunk.locals):
+            write('{"type": "local", "proto": %s, "index": %d, "name": %s, "startPC": %d, "endPC": %d}\n' % (
+                jpath, i, json.dumps(l.name), l.start, l.end))
+
+        for i, u in enumerate(chunk.upvalues):
+            write('{"type": "upvalue", "proto": %s, "index": %d, "name": %s}\n' % (jpath, i, json.dumps(u)))
+
+        # instructions are the bulk of the output, so they're formatted by hand instead of through json.dumps()
+        instrs = chunk.instructions
+        ops, As, Bs, Cs = instrs.opcodes, instrs.A, instrs.B, instrs.C
+        lines = chunk.lineNums
+        for pc in range(len(instrs)):
+            write('{"type": "instr", "proto": %s, "pc": %d, "opcode": "%s", "A": %d, "B": %d, "C": %s, "line": %s}\n' % (
+                jpath, pc, opInfo[ops[pc]].name, As[pc], Bs[pc], Cs[pc] if _HAS_C[ops[pc]] else "null",
+                lines[pc] if pc < len(lines) else "null"))
+
+        records += 1 + len(chunk.constants) + len(chunk.locals) + len(chunk.upvalues) + len(instrs)
+
+    out.write("".join(parts))
+    return records
+
+# writes [protos] ((path, chunk) pairs, see walkProtos()) into [directory] as columns. each proto's instructions are
+# appended to the column files as soon as it's streamed in
+def writeColumns(protos, directory: str) -> dict:
+    os.makedirs(directory, exist_ok=True)
+
+    manifest = {
+        "version": COLUMNS_VERSION, "byteorder": sys.byteorder, "rows": 0, "columns": {},
+        "opcodes": [info.name for info in opInfo], "protos": [],
+    }
+    files = {}
+
+    try:
+        for name, typecode in _COLUMNS:
+            manifest["columns"][name] = {"typecode": typecode, "file": name + ".bin"}
+            files[name] = open(os.path.join(directory, name + ".bin"), 'wb')
+
+        for path, chunk in protos:
+            indx = len(manifest["protos"])
+            record = _protoRecord(protoPath(path), chunk)
+            del record["type"]
+            record["firstRow"] = manifest["rows"]
+            record["constants"] = [{"kind": c.type.name, "value": _constantValue(c)} for c in chunk.constants]
+            record["locals"] = [{"name": l.name, "startPC": l.start, "endPC": l.end} for l in chunk.locals]
+            record["upvalues"] = list(chunk.upvalues)
+            manifest["protos"].append(record)
+
+            instrs = chunk.instructions
+            num = len(instrs)
+            lines = array.array('i', chunk.lineNums[:num])
+            lines.extend([-1] * (num - len(lines)))
+
+            columns = {
+                "proto": array.array('I', [indx]) * num,
+                "pc": array.array('I', range(num)),
+                "opcode": instrs.opcodes,
+                "A": instrs.A,
+                "B": instrs.B,
+                "C": array.array('h', [c if _HAS_C[op] else -1 for op, c in zip(instrs.opcodes, instrs.C)]),
+                "line": lines,
+            }
+            for name, typecode in _COLUMNS:
+                column = columns[name]
+                if column.typecode != typecode:
+                    column = array.array(typecode, column)
+                column.tofile(files[name])
+
+            manifest["rows"] += num
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(os.path.join(directory, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, allow_nan=False)
+
+    return manifest
+
+# loads an export written by writeColumns(). returns (manifest, {column name: array})
+def readColumns(directory: str) -> tuple[dict, dict]:
+    with open(os.path.join(directory, "manifest.json"), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != COLUMNS_VERSION:
+        raise Exception("Unsupported export version! [%s]" % manifest.get("version"))
+
+    columns = {}
+    for name, column in manifest["columns"].items():
+        data = array.array(column["typecode"])
+        with open(os.path.join(directory, column["file"]), 'rb') as f:
+            data.fromfile(f, manifest["rows"])
+
+        if manifest["byteorder"] != sys.byteorder:
+            data.byteswap()
+        columns[name] = data
+
+    return manifest, columns
+
+# exports the dump at [path], streaming it proto by proto. [fmt] is "jsonl" (written to [out], a path or text
+# stream) or "columns" (written into the directory [out])
+def exportFile(path: str, out, fmt: str = "jsonl"):
+    protos = LuaUndump().streamFile(path)
+
+    if fmt == "columns":
+        return writeColumns(protos, out)
+    elif fmt == "jsonl":
+        if isinstance(out, str):
+            with open(out, 'w', encoding='utf-8') as f:
+                return writeJSONL(protos, f)
+
+        return writeJSONL(protos, out)
+
+    raise Exception("Unknown export format! [%s]" % fmt)
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export Lua 5.1 dumps as JSON Lines or typed columns.")
+    parser.add_argument("input", help="dump file")
+    parser.add_argument("-f", "--format", choices=["jsonl", "columns"], default="jsonl")
+    parser.add_argument("-o", "--out", default=None, help="output file (jsonl, defaults to stdout) or directory (columns)")
+    args = parser.parse_args(argv)
+
+    if args.format == "columns" and args.out is None:
+        parser.error("columns exports need an output directory (-o)")
+
+    exportFile(args.input, args.out if args.out is not None else sys.stdout, args.format)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''
+    loadtest.py
+
+    Depends on client.py && bench.py.
+
+    Hammers a running server.py with [concurrency] clients at once && reports throughput, latency percentiles &&
+    how many requests were turned away (503) or timed out (504). Sends the given dump files, or small generated
+    dumps from bench.py's corpora when none are given.
+'''
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench
+from client import DecompClient, DEFAULT_PORT
+
+def _percentile(latencies: list[float], pct: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+
+    return statistics.quantiles(latencies, n=100, method='inclusive')[pct - 1]
+
+# sends [requests] dumps (cycling through [dumps]) from [concurrency] clients, each on its own connection
+def runLoad(dumps: list[bytes], requests: int, concurrency: int, emit: list[str], host: str = "127.0.0.1",
+            port: int = DEFAULT_PORT, unix: str = None) -> dict:
+    todo = itertools.islice(itertools.cycle(dumps), requests)
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+
+    def worker():
+        with DecompClient(host, port, unix) as client:
+            url = "/decompile?emit=" + ",".join(emit)
+            while True:
+                with lock:
+                    bytecode = next(todo, None)
+                if bytecode is None:
+                    return
+
+                start = time.perf_counter()
+                try:
+                    status = client.request("POST", url, bytecode)[0]
+                except Exception as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requestsPerSecond": requests / elapsed if elapsed > 0 else 0.0,
+        "statuses": {str(status): num for status, num in statuses.items()},
+        "latency": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+    }
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test a running server.py.")
+    parser.add_argument("inputs", nargs="*", help="dump files to send (defaults to small generated dumps)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-u", "--unix", default=None, help="connect to this unix socket instead")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-e", "--emit", default="lua", help="comma separated outputs to ask for")
+    parser.add_argument("--scale", type=float, default=0.01, help="size of the generated dumps (see bench.py)")
+    parser.add_argument("-o", "--out", default=None, help="save the results to this json file")
+    args = parser.parse_args(argv)
+
+    if args.inputs:
+        dumps = []
+        for path in args.inputs:
+            with open(path, 'rb') as f:
+                dumps.append(f.read())
+    else:
+        dumps = [bench.buildCorpus(name, args.scale) for name in bench.CORPORA]
+
+    emit = [e for e in args.emit.split(",") if e]
+    result = runLoad(dumps, args.requests, args.concurrency, emit, args.host, args.port, args.unix)
+
+    lat = result["latency"]
+    print("%d requests in %.2fs: %.1f req/s, p50 %.1fms p95 %.1fms p99 %.1fms max %.1fms" % (
+        result["requests"], result["seconds"], result["requestsPerSecond"], lat["p50"] * 1000, lat["p95"] * 1000,
+        lat["p99"] * 1000, lat["max"] * 1000), file=sys.stderr)
+    print("statuses: %s" % ", ".join("%s x%d" % s for s in sorted(result["statuses"].items())), file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    return 0 if set(result["statuses"]) <= {"200"} else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,44 @@
 '''
     lparser.py
 
-    Depends on lundump.py for lua dump deserialization.
+    Depends on lundump.py for lua dump deserialization, lcfg.py && ldataflow.py for control && data flow analysis, lcache.py
+    for proto digests && lprofile.py for (opt-in) profiling.
 
     An experimental bytecode decompiler.
 '''
 
-from lundump import Chunk, Constant, Instruction, Opcodes, whichRK, readRKasK
+import bisect
+import copy
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from lundump import Chunk, Constant, Instruction, Local, Opcodes, opInfo, whichRK, readRKasK, protoStub, isProtoStub
+from lcache import protoDigest
+from lcfg import getCFG
+from ldataflow import Dataflow
+import lprofile
+
+_LoopInstr = [Opcodes.FORLOOP, Opcodes.TFORLOOP]
+
+_ArithOps = {Opcodes.ADD: " + ", Opcodes.SUB: " - ", Opcodes.MUL: " * ", Opcodes.DIV: " / ", Opcodes.MOD: " % ", Opcodes.POW: " ^ "}
+_UnaryOps = {Opcodes.UNM: "-", Opcodes.NOT: "not ", Opcodes.LEN: "#"}
+_CompareOps = {Opcodes.EQ: " == ", Opcodes.LT: " < ", Opcodes.LE: " <= "}
+
+_opNames = [info.name for info in opInfo]
+
+# opcode -> handler, filled in by @_handles() as LuaDecomp is defined
+_handlers = {}
+
+# registers the decorated method as the handler for [opcodes]
+def _handles(*opcodes):
+    def register(handler):
+        for op in opcodes:
+            _handlers[op] = handler
+
+        return handler
+
+    return register
 
 class _Scope:
     def __init__(self, startPC: int, endPC: int):
@@ -25,6 +57,129 @@ class _Line:
         self.endPC = endPC
         self.src = src
         self.scope = scope
+        self.mark = 0 # see _LineStore
+
+# the decompiled lines of a proto. statements are appended in PC order, so their endPCs never decrease && we can
+# binary search for the one covering a PC. lines inserted later (repeat-until's 'repeat') always go right before
+# the appended line covering their PC, so every appended line heads a group: the short run of lines inserted in front
+# of it, then itself. repeat-until loops also need to indent every line in their body after the fact. instead of
+# touching every line, the first line to indent gets a +1 mark && the last line a -1 mark, && a line's shift is the
+# sum of the marks at or before its position (kept per group in a fenwick tree, since groups never move)
+# NOTE: a stored line's scope is relative to the marks before it when it was added, use scopeAt() or getLines()
+class _LineStore:
+    def __init__(self):
+        self.groups: list[list[_Line]] = [] # inserted lines, then the appended line they're in front of
+        self.ends: list[int] = [] # endPC of each group's appended line
+        self.marks = [0] # fenwick tree over groups, grown as they're appended
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    # adds [delta] to group [k]'s marks
+    def __addMark(self, k: int, delta: int) -> None:
+        i = k + 1
+        while i < len(self.marks):
+            self.marks[i] += delta
+            i += i & -i
+
+    # sum of the marks in every group before [k]
+    def __getMarks(self, k: int) -> int:
+        i = k
+        total = 0
+        while i > 0:
+            total += self.marks[i]
+            i -= i & -i
+
+        return total
+
+    def __newGroup(self) -> None:
+        # a fenwick node covers the groups (i - lowbit(i), i], which all exist already && have no marks yet
+        i = len(self.marks)
+        node = 0
+        j = i - 1
+        while j > i - (i & -i):
+            node += self.marks[j]
+            j -= j & -j
+        self.marks.append(node)
+
+    # shift of the line at [pos] ((group, index in group), see find())
+    def __shiftAt(self, pos: tuple[int, int]) -> int:
+        k, j = pos
+        group = self.groups[k]
+        return self.__getMarks(k) + sum(group[i].mark for i in range(j + 1))
+
+    def scopeAt(self, pos: tuple[int, int]) -> int:
+        k, j = pos
+        return self.groups[k][j].scope + self.__shiftAt(pos)
+
+    # position of the line right before [pos], or None
+    def before(self, pos: tuple[int, int]) -> tuple[int, int]:
+        k, j = pos
+        if j > 0:
+            return (k, j - 1)
+        if k > 0:
+            return (k - 1, len(self.groups[k - 1]) - 1)
+
+        return None
+
+    def last(self) -> _Line:
+        group = self.groups[len(self.groups) - 1]
+        return group[len(group) - 1]
+
+    def append(self, line: _Line) -> None:
+        self.__newGroup()
+        line.scope -= self.__getMarks(len(self.groups))
+        self.groups.append([line])
+        self.ends.append(line.endPC)
+        self.size += 1
+
+    # position of the first line covering [pc], or None. inside a group only the appended line covers more than one
+    # PC, so it's the first inserted line starting at [pc], or else the appended line itself
+    def find(self, pc: int) -> tuple[int, int]:
+        k = bisect.bisect_left(self.ends, pc)
+        if k >= len(self.groups):
+            return None
+
+        group = self.groups[k]
+        for j in range(len(group)):
+            if group[j].startPC <= pc:
+                return (k, j)
+
+        return None
+
+    # inserts [line] before the line at [pos]
+    def insert(self, pos: tuple[int, int], line: _Line) -> None:
+        k, j = pos
+        self.groups[k].insert(j, line)
+        line.scope -= self.__shiftAt(pos)
+        self.size += 1
+
+    # indents every line after [pos], up to (but not including) the last line, by [delta] more scopes
+    def shiftAfter(self, pos: tuple[int, int], delta: int) -> None:
+        k, j = pos
+        if j + 1 < len(self.groups[k]):
+            first = (k, j + 1)
+        elif k + 1 < len(self.groups):
+            first = (k + 1, 0)
+        else: # nothing after it
+            return
+
+        lastK = len(self.groups) - 1
+        for (k, j), d in ((first, delta), ((lastK, len(self.groups[lastK]) - 1), -delta)):
+            self.groups[k][j].mark += d
+            self.__addMark(k, d)
+
+    # the lines with their final scopes
+    def getLines(self) -> list[_Line]:
+        lines = []
+        shift = 0
+        for group in self.groups:
+            for l in group:
+                shift += l.mark
+                lines.append(_Line(l.startPC, l.endPC, l.src, l.scope + shift))
+
+        return lines
 
 def isValidLocal(ident: str) -> bool:
     # has to start with an alpha or _
@@ -38,25 +193,109 @@ def isValidLocal(ident: str) -> bool:
 
     return True
 
+# a rope of code fragments. concatenating ropes (or a rope && a str) just links them together, so large chunks of
+# code (like decompiled closures) are never copied until the whole thing is rendered once, at the very end
+class _Rope:
+    __slots__ = ('parts',)
+
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def __add__(self, other):
+        return _Rope(self, other)
+
+    def __radd__(self, other):
+        return _Rope(other, self)
+
+    # calls [write] with every fragment, in order
+    def writeTo(self, write) -> None:
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, _Rope):
+                stack.extend(reversed(node.parts))
+            else:
+                write(node)
+
+    def __str__(self) -> str:
+        fragments = []
+        self.writeTo(fragments.append)
+        return "".join(fragments)
+
+# if [annotateLines], every line is preceded by a comment with the PCs (&& source lines, when [chunk] has line info)
+# it was decompiled from
+def _renderLines(lines: list[_Line], scopeOffset: int, indexWidth: int, annotateLines: bool, chunk: Chunk = None) -> _Rope:
+    parts = []
+    indents = {}
+
+    for line in lines:
+        if annotateLines:
+            span = chunk.getLineSpan(line.startPC, line.endPC) if chunk is not None else None
+            if span is None:
+                parts.append("-- PC: %d to PC: %d\n" % (line.startPC, line.endPC))
+            elif span[0] == span[1]:
+                parts.append("-- PC: %d to PC: %d (line %d)\n" % (line.startPC, line.endPC, span[0]))
+            else:
+                parts.append("-- PC: %d to PC: %d (lines %d to %d)\n" % (line.startPC, line.endPC, span[0], span[1]))
+
+        depth = line.scope + scopeOffset
+        if depth not in indents:
+            indents[depth] = (' ' * indexWidth) * depth
+
+        parts.append(indents[depth])
+        parts.append(line.src)
+        parts.append("\n")
+
+    return _Rope(*parts)
+
 class LuaDecomp:
-    def __init__(self, chunk: Chunk, headChunk: bool = True, scopeOffset: int = 0):
+    # [protoHook] is called as protoHook(protoIndx, scopeOffset) for every CLOSURE instead of decompiling the
+    # child proto in place, and should return the code to use for it. if a [cache] (see lcache.DecompCache) is
+    # given, child protos that were already decompiled are reused from it. with [dataflowLocals], registers whose
+    # value is read more than once are made locals (instead of duplicating their expression at every read)
+    def __init__(self, chunk: Chunk, headChunk: bool = True, scopeOffset: int = 0, protoHook = None, cache = None,
+                 dataflowLocals: bool = False):
         self.chunk = chunk
+        self.cfg = getCFG(chunk)
+        self.dataflowLocals = dataflowLocals
+        self.dataflow = Dataflow(chunk) if dataflowLocals else None
+        self.protoHook = protoHook
+        self.cache = cache
         self.pc = 0
         self.scope: list[_Scope] = []
-        self.lines: list[_Line] = []
+        self.lines = _LineStore()
         self.top = {}
-        self.locals = {}
+        self.locals = {} # register -> identifier
+        self.localVars = {} # register -> the debug Local it's currently named after
         self.traceback = {}
+        self.defined = set() # every register that's been set so far
+        self.regSets = {} # register -> PCs it was set at, in order
+        self.regUses = {} # register -> PCs it was read at, in order
         self.unknownLocalCount = 0
         self.headChunk = headChunk
         self.scopeOffset = scopeOffset # number of scopes this chunk/proto is in
-        self.src: str = ""
+        self.src: list = [] # fragments of the statement we're currently building
 
         # configurations!
         self.aggressiveLocals = False # should *EVERY* set register be considered a local? 
         self.annotateLines = False
         self.indexWidth = 4 # how many spaces for indentions?
 
+        # profiling is opt-in (see lprofile.py), when it's off the handlers aren't even wrapped
+        profiler = lprofile.active()
+        if profiler is None:
+            self.__decompile()
+            return
+
+        self.handlers = profiler.wrapHandlers(type(self).handlers, _opNames)
+        with profiler.stage("decompile"):
+            start = profiler.beginProto()
+            try:
+                self.__decompile()
+            finally:
+                profiler.endProto(start, str(self.chunk.name), len(self.chunk.instructions))
+
+    def __decompile(self) -> None:
         self.__loadLocals()
 
         if not self.headChunk:
@@ -84,21 +323,27 @@ class LuaDecomp:
         if not self.headChunk:
             self.__endScope()
 
+    # the decompiled lines, in order
+    def getLines(self) -> list[_Line]:
+        return self.lines.getLines()
+
     def getPseudoCode(self) -> str:
-        fullSrc = ""
+        return str(self.getPseudoCodeRope())
 
-        for line in self.lines:
-            if self.annotateLines:
-                fullSrc += "-- PC: %d to PC: %d\n" % (line.startPC, line.endPC)
-            fullSrc += ((' ' * self.indexWidth) * (line.scope + self.scopeOffset)) + line.src + "\n"
+    def getPseudoCodeRope(self) -> _Rope:
+        return _renderLines(self.getLines(), self.scopeOffset, self.indexWidth, self.annotateLines, self.chunk)
 
-        return fullSrc
+    # streams the pseudo-code to a text file object (or anything else with a write() method)
+    def writePseudoCode(self, out) -> None:
+        self.getPseudoCodeRope().writeTo(out.write)
 
     # =======================================[[ Helpers ]]=========================================
 
     def __getInstrAtPC(self, pc: int) -> Instruction:
-        if pc < len(self.chunk.instructions):
-            return self.chunk.instructions[pc]
+        # bounds check against the opcode column directly, this runs for every instruction
+        instrs = self.chunk.instructions
+        if pc < len(instrs.opcodes):
+            return instrs[pc]
 
         raise Exception("Decompilation failed!")
 
@@ -116,53 +361,91 @@ class LuaDecomp:
     def __addUseTraceback(self, reg: int) -> None:
         self.__makeTracIfNotExist()
         self.traceback[self.pc].uses.append(reg)
+        self.regUses.setdefault(reg, []).append(self.pc)
 
     # when we write from a register, call this
     def __addSetTraceback(self, reg: int) -> None:
         self.__makeTracIfNotExist()
         self.traceback[self.pc].sets.append(reg)
+        self.regSets.setdefault(reg, []).append(self.pc)
+        self.defined.add(reg)
+
+    # PCs (so far) that [reg] was set at
+    def getRegSets(self, reg: int) -> list[int]:
+        return self.regSets.get(reg, [])
+
+    # PCs (so far) that [reg] was read at
+    def getRegUses(self, reg: int) -> list[int]:
+        return self.regUses.get(reg, [])
+
+    # was [reg] read at any point after [pc]? (PCs are recorded in order, so this is just a binary search)
+    def isUsedAfter(self, reg: int, pc: int) -> bool:
+        uses = self.getRegUses(reg)
+        return bisect.bisect_right(uses, pc) < len(uses)
 
     def __addExpr(self, code: str) -> None:
-        self.src += code
+        if not code == "":
+            self.src.append(code)
+
+    # takes the statement we've built so far
+    def __takeStatement(self):
+        src = self.src[0] if len(self.src) == 1 else _Rope(*self.src)
+        self.src = []
+        return src
 
     def __endStatement(self):
-        startPC = self.lines[len(self.lines) - 1].endPC + 1 if len(self.lines) > 0 else 0
+        startPC = self.lines.last().endPC + 1 if len(self.lines) > 0 else 0
         endPC = self.pc
 
         # make sure we don't write an empty line
-        if not self.src == "":
-            self.lines.append(_Line(startPC, endPC, self.src, len(self.scope)))
-        self.src = ""
+        if len(self.src) > 0:
+            self.lines.append(_Line(startPC, endPC, self.__takeStatement(), len(self.scope)))
 
-    def __insertStatement(self, pc: int) -> None:
+    # returns the position of the inserted line (see _LineStore)
+    def __insertStatement(self, pc: int) -> tuple[int, int]:
         # insert current statement into lines at pc location
-        for i in range(len(self.lines)):
-            if self.lines[i].startPC <= pc and self.lines[i].endPC >= pc:
-                self.lines.insert(i, _Line(pc, pc, self.src, self.lines[i-1].scope if i > 0 else 0))
-                self.src = ""
-                return i
+        pos = self.lines.find(pc)
+        if pos is None:
+            raise Exception("Decompilation failed!")
 
-        self.src = ""
+        prev = self.lines.before(pos)
+        scope = self.lines.scopeAt(prev) if prev is not None else 0
+        self.lines.insert(pos, _Line(pc, pc, self.__takeStatement(), scope))
+        return pos
 
-    # walks traceback, if local wasn't set before, the local needs to be defined
+    # if the local wasn't set before, the local needs to be defined
     def __needsDefined(self, reg) -> bool:
-        for _, trace in self.traceback.items():
-            if reg in trace.sets:
-                return False
-
-        # wasn't set in traceback! needs defined!
-        return True
+        return reg not in self.defined
 
+    # names every register after the first local it holds, the rest are picked up by __enterLocal() as they come
+    # into scope
     def __loadLocals(self):
-        for i in range(len(self.chunk.locals)):
-            name = self.chunk.locals[i].name
-            if isValidLocal(name):
-                self.locals[i] = name
-            elif "(for " not in name: # if it's a for loop register, ignore
-                self.__makeLocalIdentifier(i)
+        index = self.chunk.getLocalIndex()
+        for l, reg in zip(index.locals, index.registers):
+            if reg not in self.localVars:
+                self.__nameLocal(reg, l)
+
+    def __nameLocal(self, indx: int, l: Local) -> None:
+        self.localVars[indx] = l
+        if isValidLocal(l.name):
+            self.locals[indx] = l.name
+        elif "(for " not in l.name: # if it's a for loop register, ignore
+            self.locals.pop(indx, None)
+            self.__makeLocalIdentifier(indx)
+
+    # registers get reused once their local goes out of scope. if a different local comes into scope in [indx] after
+    # the current instruction, switch over to it (it needs its own 'local' declaration too)
+    def __enterLocal(self, indx: int) -> None:
+        l = self.chunk.getLocalAt(indx, self.pc + 1)
+        if l is None or l is self.localVars.get(indx) or "(for " in l.name:
+            return
+
+        self.__nameLocal(indx, l)
+        self.defined.discard(indx)
 
     # when you *know* the register *has* to be a local (for loops, etc.)
     def __getLocal(self, indx: int) -> str:
+        self.__enterLocal(indx)
         return self.locals[indx] if indx in self.locals else self.__makeLocalIdentifier(indx)
 
     def __getReg(self, indx: int) -> str:
@@ -171,7 +454,10 @@ class LuaDecomp:
         # if the top indx is a local, get it
         return self.locals[indx] if indx in self.locals else self.top[indx]
 
-    def __setReg(self, indx: int, code: str, forceLocal: bool = False) -> None:
+    # [pc] is where the value is set, if that's not the instruction we're on
+    def __setReg(self, indx: int, code: str, forceLocal: bool = False, pc: int = None) -> None:
+        self.__enterLocal(indx)
+
         # if the top indx is a local, set it
         if indx in self.locals:
             if self.__needsDefined(indx):
@@ -179,12 +465,26 @@ class LuaDecomp:
             else:
                 self.__addExpr(self.locals[indx] + " = " + code)
                 self.__endStatement()
-        elif self.aggressiveLocals or forceLocal: # 'every register is a local!!'
+        elif self.aggressiveLocals or forceLocal or self.__isShared(indx, self.pc if pc is None else pc): # 'every register is a local!!'
             self.__newLocal(indx, code)
 
         self.__addSetTraceback(indx)
         self.top[indx] = code
 
+    # is the value [indx] is set to at [defPC] read in more than one place? (if so, inlining it would duplicate it)
+    def __isShared(self, indx: int, defPC: int) -> bool:
+        if self.dataflow is None:
+            return False
+
+        # FORLOOP/TFORLOOP re-read the loop's control registers every iteration, but those reads never show up in
+        # the source, so they don't count
+        reads = 0
+        for pc in self.dataflow.reaching.usesOf(defPC, indx):
+            if not self.chunk.instructions.opcodes[pc] in _LoopInstr:
+                reads += 1
+
+        return reads > 1
+
     # ========================================[[ Locals ]]=========================================
 
     def __makeLocalIdentifier(self, indx: int) -> str:
@@ -226,6 +526,20 @@ class LuaDecomp:
 
         self.__endStatement()
 
+    def __decompileProto(self, indx: int) -> str:
+        if self.protoHook is not None:
+            return self.protoHook(indx, len(self.scope))
+
+        if isProtoStub(self.chunk.protos[indx]):
+            raise Exception("Proto %d was streamed without its code, use decompileStream()!" % indx)
+
+        if self.cache is not None:
+            return decompileCached(self.chunk.protos[indx], self.cache, headChunk=False, scopeOffset=len(self.scope),
+                                   dataflowLocals=self.dataflowLocals)
+
+        proto = LuaDecomp(self.chunk.protos[indx], headChunk=False, scopeOffset=len(self.scope), dataflowLocals=self.dataflowLocals)
+        return proto.getPseudoCodeRope()
+
     # =====================================[[ Instructions ]]======================================
 
     def __emitOperand(self, a: int, b: str, c: str, op: str) -> None:
@@ -237,13 +551,19 @@ class LuaDecomp:
         jmpType = "if"
         scopeStart = "then"
 
+        # the next instr is the JMP taken when the condition passes
+        target = self.cfg.jumpTarget(self.pc + 1)
+        if target is None:
+            raise Exception("Decompilation failed!")
+
         # we need to check if the jmp location has a jump back (if so, it's a while loop)
-        jmp = self.__getNextInstr().B + 1
-        jmpToInstr = self.__getInstrAtPC(self.pc + jmp)
+        jmp = target - self.pc - 1
+        jmpTo = self.pc + jmp
+        jmpToInstr = self.__getInstrAtPC(jmpTo)
 
         if jmpToInstr.opcode == Opcodes.JMP:
             # if this jump jumps back to this compJmp, it's a loop!
-            if self.pc + jmp + jmpToInstr.B <= self.pc + 1:
+            if self.cfg.jumpTarget(jmpTo) - 1 <= self.pc + 1:
                 jmpType = "while"
                 scopeStart = "do"
         elif jmp < 0:
@@ -274,11 +594,10 @@ class LuaDecomp:
 
             # it's a repeat until loop, insert 'repeat' at the jumpTo location
             self.__addExpr("repeat")
-            insertedLine = self.__insertStatement(self.pc + jmp)
+            repeatPos = self.__insertStatement(self.pc + jmp)
 
             # add scope to every line in-between
-            for i in range(insertedLine+1, len(self.lines)-1):
-                self.lines[i].scope += 1
+            self.lines.shiftAfter(repeatPos, 1)
 
     # 'RK's are special in because can be a register or a konstant. a bitflag is read to determine which
     def __readRK(self, rk: int) -> str:
@@ -293,16 +612,16 @@ class LuaDecomp:
         tblOps = [Opcodes.LOADK, Opcodes.SETLIST]
 
         instr = self.__getNextInstr()
-        cachedRegs = {}
+        cachedRegs = {} # register -> (code, pc of the LOADK setting it)
         tbl = "{"
         while instr.opcode in tblOps:
             if instr.opcode == Opcodes.LOADK: # operate on registers
-                cachedRegs[instr.A] = self.chunk.getConstant(instr.B).toCode()
+                cachedRegs[instr.A] = (self.chunk.getConstant(instr.B).toCode(), self.pc + 1)
             elif instr.opcode == Opcodes.SETLIST:
                 numElems = instr.B
 
                 for i in range(numElems):
-                    tbl += "%s, " % cachedRegs[instr.A + i + 1]
+                    tbl += "%s, " % cachedRegs[instr.A + i + 1][0]
                     del cachedRegs[instr.A + i + 1]
 
             self.pc += 1
@@ -315,132 +634,305 @@ class LuaDecomp:
         self.__setReg(indx, tbl, forceLocal=True)
         self.__endStatement()
 
-        # if we have leftovers... oops, set those
-        for i, v in cachedRegs.items():
-            self.__setReg(i, v)
+        # if we have leftovers... oops, set those. we're past their LOADKs by now, so tell __setReg where they were
+        for i, (v, pc) in cachedRegs.items():
+            self.__setReg(i, v, pc=pc)
 
     def parseInstr(self):
+        # dispatch straight off the opcode column, the Instruction view is only built for the handler
         instr = self.__getCurrInstr()
+        handler = self.handlers[self.chunk.instructions.opcodes[self.pc]]
 
-        match instr.opcode:
-            case Opcodes.MOVE: # move is a fake ABC instr, C is ignored
-                # move registers
-                self.__setReg(instr.A, self.__getReg(instr.B))
-            case Opcodes.LOADK:
-                self.__setReg(instr.A, self.chunk.getConstant(instr.B).toCode())
-            case Opcodes.LOADBOOL:
-                if instr.B == 0:
-                    self.__setReg(instr.A, "false")
-                else:
-                    self.__setReg(instr.A, "true")
-            case Opcodes.GETGLOBAL:
-                self.__setReg(instr.A, self.chunk.getConstant(instr.B).data)
-            case Opcodes.GETTABLE:
-                self.__setReg(instr.A, self.__getReg(instr.B) + "[" + self.__readRK(instr.C) + "]")
-            case Opcodes.SETGLOBAL:
-                self.__addExpr(self.chunk.getConstant(instr.B).data + " = " + self.__getReg(instr.A))
-                self.__endStatement()
-            case Opcodes.SETTABLE:
-                self.__addExpr(self.__getReg(instr.A) + "[" + self.__readRK(instr.B) + "] = " + self.__readRK(instr.C))
-                self.__endStatement()
-            case Opcodes.NEWTABLE:
-                self.__parseNewTable(instr.A)
-            case Opcodes.ADD:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " + ")
-            case Opcodes.SUB:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " - ")
-            case Opcodes.MUL:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " * ")
-            case Opcodes.DIV:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " / ")
-            case Opcodes.MOD:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " % ")
-            case Opcodes.POW:
-                self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), " ^ ")
-            case Opcodes.UNM:
-                self.__setReg(instr.A, "-" + self.__getReg(instr.B))
-            case Opcodes.NOT:
-                self.__setReg(instr.A, "not " + self.__getReg(instr.B))
-            case Opcodes.LEN:
-                self.__setReg(instr.A, "#" + self.__getReg(instr.B))
-            case Opcodes.CONCAT:
-                count = instr.C-instr.B+1
-                concatStr = ""
-
-                # concat all items on stack from RC to RB
-                for i in range(count):
-                    concatStr += self.__getReg(instr.B + i) + (" .. " if not i == count - 1 else "")
-
-                self.__setReg(instr.A, concatStr)
-            case Opcodes.JMP:
-                pass
-            case Opcodes.EQ:
-                self.__condJmp(" == ")
-            case Opcodes.LT:
-                self.__condJmp(" < ")
-            case Opcodes.LE:
-                self.__condJmp(" <= ")
-            case Opcodes.TEST:
-                if instr.C == 0:
-                    self.__condJmp("", False)
+        if handler is None:
+            raise Exception("unsupported instruction: %s" % instr.toString())
+
+        handler(self, instr)
+
+    # plugs in (or replaces) the handler for [opcode], called as handler(decomp, instr). handlers registered on a
+    # subclass don't affect its parents
+    @classmethod
+    def setHandler(cls, opcode: Opcodes, handler) -> None:
+        if "handlers" not in cls.__dict__:
+            cls.handlers = list(cls.handlers)
+
+        cls.handlers[opcode] = handler
+
+    @_handles(Opcodes.MOVE)
+    def __opMove(self, instr: Instruction):
+        # move is a fake ABC instr, C is ignored
+        self.__setReg(instr.A, self.__getReg(instr.B))
+
+    @_handles(Opcodes.LOADK)
+    def __opLoadK(self, instr: Instruction):
+        self.__setReg(instr.A, self.chunk.getConstant(instr.B).toCode())
+
+    @_handles(Opcodes.LOADBOOL)
+    def __opLoadBool(self, instr: Instruction):
+        if instr.B == 0:
+            self.__setReg(instr.A, "false")
+        else:
+            self.__setReg(instr.A, "true")
+
+    @_handles(Opcodes.GETGLOBAL)
+    def __opGetGlobal(self, instr: Instruction):
+        self.__setReg(instr.A, self.chunk.getConstant(instr.B).getText())
+
+    @_handles(Opcodes.GETTABLE)
+    def __opGetTable(self, instr: Instruction):
+        self.__setReg(instr.A, self.__getReg(instr.B) + "[" + self.__readRK(instr.C) + "]")
+
+    @_handles(Opcodes.SETGLOBAL)
+    def __opSetGlobal(self, instr: Instruction):
+        self.__addExpr(self.chunk.getConstant(instr.B).getText() + " = " + self.__getReg(instr.A))
+        self.__endStatement()
+
+    @_handles(Opcodes.SETTABLE)
+    def __opSetTable(self, instr: Instruction):
+        self.__addExpr(self.__getReg(instr.A) + "[" + self.__readRK(instr.B) + "] = " + self.__readRK(instr.C))
+        self.__endStatement()
+
+    @_handles(Opcodes.NEWTABLE)
+    def __opNewTable(self, instr: Instruction):
+        self.__parseNewTable(instr.A)
+
+    @_handles(*_ArithOps)
+    def __opArith(self, instr: Instruction):
+        self.__emitOperand(instr.A, self.__readRK(instr.B), self.__readRK(instr.C), _ArithOps[instr.opcode])
+
+    @_handles(*_UnaryOps)
+    def __opUnary(self, instr: Instruction):
+        self.__setReg(instr.A, _UnaryOps[instr.opcode] + self.__getReg(instr.B))
+
+    @_handles(Opcodes.CONCAT)
+    def __opConcat(self, instr: Instruction):
+        count = instr.C-instr.B+1
+        concatStr = ""
+
+        # concat all items on stack from RC to RB
+        for i in range(count):
+            concatStr += self.__getReg(instr.B + i) + (" .. " if not i == count - 1 else "")
+
+        self.__setReg(instr.A, concatStr)
+
+    @_handles(Opcodes.JMP, Opcodes.FORLOOP)
+    def __opNop(self, instr: Instruction):
+        pass # no-op for now
+
+    @_handles(*_CompareOps)
+    def __opCompare(self, instr: Instruction):
+        self.__condJmp(_CompareOps[instr.opcode])
+
+    @_handles(Opcodes.TEST)
+    def __opTest(self, instr: Instruction):
+        if instr.C == 0:
+            self.__condJmp("", False)
+        else:
+            self.__condJmp("not ", False)
+
+    @_handles(Opcodes.CALL)
+    def __opCall(self, instr: Instruction):
+        preStr = ""
+        callStr = ""
+        ident = ""
+
+        # parse arguments
+        callStr += self.__getReg(instr.A) + "("
+        for i in range(instr.A + 1, instr.A + instr.B):
+            callStr += self.__getReg(i) + (", " if not i + 1 == instr.A + instr.B else "")
+        callStr += ")"
+
+        # parse return values
+        if instr.C > 1:
+            preStr = "local "
+            for indx  in range(instr.A, instr.A + instr.C - 1):
+                self.__enterLocal(indx)
+                if indx in self.locals:
+                    ident = self.locals[indx]
                 else:
-                    self.__condJmp("not ", False)
-            case Opcodes.CALL:
-                preStr = ""
-                callStr = ""
-                ident = ""
-
-                # parse arguments
-                callStr += self.__getReg(instr.A) + "("
-                for i in range(instr.A + 1, instr.A + instr.B):
-                    callStr += self.__getReg(i) + (", " if not i + 1 == instr.A + instr.B else "")
-                callStr += ")"
-
-                # parse return values
-                if instr.C > 1:
-                    preStr = "local "
-                    for indx  in range(instr.A, instr.A + instr.C - 1):
-                        if indx in self.locals:
-                            ident = self.locals[indx]
-                        else:
-                            ident = self.__makeLocalIdentifier(indx)
-                        preStr += ident
-
-                        # normally setReg() does this
-                        self.top[indx] = ident
-
-                        # just so we don't have a trailing ', '
-                        preStr += ", " if not indx == instr.A + instr.C - 2 else ""
-                    preStr += " = "
-
-                self.__addExpr(preStr + callStr)
-                self.__endStatement()
-            case Opcodes.RETURN:
-                self.__endStatement()
-                pass # no-op for now
-            case Opcodes.FORLOOP:
-                pass # no-op for now
-            case Opcodes.FORPREP:
-                self.__addExpr("for %s = %s, %s, %s " % (self.__getLocal(instr.A+3), self.__getReg(instr.A), self.__getReg(instr.A + 1), self.__getReg(instr.A + 2)))
-                self.__startScope("do", self.pc, instr.B)
-            case Opcodes.SETLIST:
-                # LFIELDS_PER_FLUSH (50) is the number of elements that *should* have been set in the list in the *last* SETLIST
-                # eg.
-                # [ 49]      LOADK :  R[49]   K[1]               ; load 0.0 into R[49]
-                # [ 50]      LOADK :  R[50]   K[1]               ; load 0.0 into R[50]
-                # [ 51]    SETLIST :      0     50      1        ; sets list[1..50]
-                # [ 52]      LOADK :   R[1]   K[1]               ; load 0.0 into R[1]
-                # [ 53]    SETLIST :      0      1      2        ; sets list[51..51]
-                numElems = instr.B
-                startAt = ((instr.C - 1) * 50)
-                ident = self.__getLocal(instr.A)
+                    ident = self.__makeLocalIdentifier(indx)
+                preStr += ident
 
-                # set each index (TODO: make tables less verbose)
-                for i in range(numElems):
-                    self.__addExpr("%s[%d] = %s" % (ident, (startAt + i + 1), self.__getReg(instr.A + i + 1)))
-                    self.__endStatement()
-            case Opcodes.CLOSURE:
-                proto = LuaDecomp(self.chunk.protos[instr.B], headChunk=False, scopeOffset=len(self.scope))
-                self.__setReg(instr.A, proto.getPseudoCode())
-            case _:
-                raise Exception("unsupported instruction: %s" % instr.toString())
\ No newline at end of file
+                # normally setReg() does this
+                self.top[indx] = ident
+
+                # just so we don't have a trailing ', '
+                preStr += ", " if not indx == instr.A + instr.C - 2 else ""
+            preStr += " = "
+
+        self.__addExpr(preStr + callStr)
+        self.__endStatement()
+
+    @_handles(Opcodes.RETURN)
+    def __opReturn(self, instr: Instruction):
+        self.__endStatement()
+        pass # no-op for now
+
+    @_handles(Opcodes.FORPREP)
+    def __opForPrep(self, instr: Instruction):
+        self.__addExpr("for %s = %s, %s, %s " % (self.__getLocal(instr.A+3), self.__getReg(instr.A), self.__getReg(instr.A + 1), self.__getReg(instr.A + 2)))
+        self.__startScope("do", self.pc, instr.B)
+
+    @_handles(Opcodes.SETLIST)
+    def __opSetList(self, instr: Instruction):
+        # LFIELDS_PER_FLUSH (50) is the number of elements that *should* have been set in the list in the *last* SETLIST
+        # eg.
+        # [ 49]      LOADK :  R[49]   K[1]               ; load 0.0 into R[49]
+        # [ 50]      LOADK :  R[50]   K[1]               ; load 0.0 into R[50]
+        # [ 51]    SETLIST :      0     50      1        ; sets list[1..50]
+        # [ 52]      LOADK :   R[1]   K[1]               ; load 0.0 into R[1]
+        # [ 53]    SETLIST :      0      1      2        ; sets list[51..51]
+        numElems = instr.B
+        startAt = ((instr.C - 1) * 50)
+        ident = self.__getLocal(instr.A)
+
+        # set each index (TODO: make tables less verbose)
+        for i in range(numElems):
+            self.__addExpr("%s[%d] = %s" % (ident, (startAt + i + 1), self.__getReg(instr.A + i + 1)))
+            self.__endStatement()
+
+    @_handles(Opcodes.CLOSURE)
+    def __opClosure(self, instr: Instruction):
+        self.__setReg(instr.A, self.__decompileProto(instr.B))
+
+# the dispatch table, indexed by opcode. opcodes without a handler are unsupported
+LuaDecomp.handlers = [_handlers.get(op) for op in range(len(Opcodes))]
+
+# =======================================[[ Caching ]]=========================================
+
+# the head chunk && a function proto decompile differently (as do different options), so they're cached separately
+def _cacheKey(chunk: Chunk, headChunk: bool, dataflowLocals: bool) -> str:
+    return protoDigest(chunk) + (":head" if headChunk else ":proto") + (":dataflow" if dataflowLocals else "")
+
+def _linesToEntry(lines: list[_Line], indexWidth: int) -> dict:
+    return {"indexWidth": indexWidth, "lines": [[l.startPC, l.endPC, str(l.src), l.scope] for l in lines]}
+
+def _entryToLines(entry: dict) -> list[_Line]:
+    return [_Line(startPC, endPC, src, scope) for startPC, endPC, src, scope in entry["lines"]]
+
+# same as LuaDecomp(chunk, ...).getPseudoCode(), but reuses (or fills) [cache]. cached entries don't depend on
+# [scopeOffset], so a proto is reused no matter how deeply it's nested
+def decompileCached(chunk: Chunk, cache, headChunk: bool = True, scopeOffset: int = 0, dataflowLocals: bool = False) -> str:
+    key = _cacheKey(chunk, headChunk, dataflowLocals)
+    entry = cache.get(key)
+
+    if entry is None:
+        decomp = LuaDecomp(chunk, headChunk=headChunk, cache=cache, dataflowLocals=dataflowLocals)
+        entry = _linesToEntry(decomp.getLines(), decomp.indexWidth)
+        cache.put(key, entry)
+
+    return str(_renderLines(_entryToLines(entry), scopeOffset, entry["indexWidth"], False))
+
+# ====================================[[ Parallel decompilation ]]=====================================
+
+# stands in for a child proto's code until it's spliced back in by decompileParallel()
+def _protoMarker(indx: int, scopeOffset: int) -> str:
+    return "\x00CLOSURE %d %d\x00" % (indx, scopeOffset)
+
+_PROTO_MARKER = re.compile("\x00CLOSURE \\d+ \\d+\x00")
+
+# runs in a worker process. decompiles a single proto, leaving markers where its children go
+def _decompileJob(job: tuple):
+    chunk, headChunk, dataflowLocals = job
+    children = {}
+
+    def protoHook(indx: int, scopeOffset: int) -> str:
+        marker = _protoMarker(indx, scopeOffset)
+        children[marker] = (indx, scopeOffset)
+        return marker
+
+    decomp = LuaDecomp(chunk, headChunk=headChunk, protoHook=protoHook, dataflowLocals=dataflowLocals)
+    return decomp.getLines(), decomp.indexWidth, children
+
+# walks the proto tree, returning each proto's path, the proto, a copy of it that doesn't hold onto its children
+# (so we only send each worker the proto it actually needs) && its cache entry. subtrees that are already in
+# [cache] are returned with their entry instead of a copy, && aren't walked any further
+def _flattenProtos(chunk: Chunk, cache, dataflowLocals: bool, path: tuple = ()):
+    entry = cache.get(_cacheKey(chunk, len(path) == 0, dataflowLocals)) if cache is not None else None
+    if entry is not None:
+        yield path, chunk, None, entry
+        return
+
+    shallow = copy.copy(chunk)
+    shallow.protos = [protoStub(p) for p in chunk.protos]
+    yield path, chunk, shallow, None
+
+    for i in range(len(chunk.protos)):
+        yield from _flattenProtos(chunk.protos[i], cache, dataflowLocals, path + (i,))
+
+# decompiles every proto in [chunk]'s tree across a pool of worker processes && splices the results back
+# together. the output is identical to LuaDecomp(chunk).getPseudoCode(). pass [executor] to reuse an existing pool,
+# && [cache] to skip protos that were already decompiled (newly decompiled ones are added to it)
+def decompileParallel(chunk: Chunk, workers: int = None, executor: ProcessPoolExecutor = None, cache = None,
+                      dataflowLocals: bool = False) -> str:
+    if executor is None:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return decompileParallel(chunk, workers, pool, cache, dataflowLocals)
+
+    protos, paths, jobs = {}, [], []
+    results = {}
+    for path, proto, shallow, entry in _flattenProtos(chunk, cache, dataflowLocals):
+        protos[path] = proto
+        if entry is not None:
+            results[path] = (_entryToLines(entry), entry["indexWidth"], None)
+        else:
+            paths.append(path)
+            jobs.append((shallow, len(path) == 0, dataflowLocals))
+
+    workers = workers or os.cpu_count() or 1
+    results.update(zip(paths, executor.map(_decompileJob, jobs, chunksize=max(1, len(jobs) // (workers * 4)))))
+
+    def spliced(path: tuple, lines: list[_Line], indexWidth: int):
+        if cache is not None:
+            cache.put(_cacheKey(protos[path], len(path) == 0, dataflowLocals), _linesToEntry(lines, indexWidth))
+
+    lines, indexWidth = _splice(results, (), spliced)
+    return str(_renderLines(lines, 0, indexWidth, False))
+
+# fills in the markers in [path]'s lines with its rendered children. [results] maps every path to what
+# _decompileJob() returned for it, or to (lines, indexWidth, None) once it's been spliced. [spliced] is called as
+# spliced(path, lines, indexWidth) for every proto that gets spliced
+def _splice(results: dict, path: tuple, spliced = None) -> tuple[list[_Line], int]:
+    lines, indexWidth, children = results[path]
+    if children is None: # came from the cache, or already spliced
+        return lines, indexWidth
+
+    rendered = {}
+    for marker, (indx, childOffset) in children.items():
+        childLines, childWidth = _splice(results, path + (indx,), spliced)
+        rendered[marker] = str(_renderLines(childLines, childOffset, childWidth, False))
+
+    # every marker in a line is swapped in one pass, && most lines don't have any
+    swap = lambda m: rendered[m.group(0)]
+    out = []
+    for line in lines:
+        src = str(line.src)
+        if "\x00" in src:
+            src = _PROTO_MARKER.sub(swap, src)
+        out.append(_Line(line.startPC, line.endPC, src, line.scope))
+
+    if spliced is not None:
+        spliced(path, out, indexWidth)
+
+    return out, indexWidth
+
+# decompiles the protos yielded by LuaUndump.stream_chunks() as they arrive. children are yielded before their
+# parents, so each proto is decompiled && spliced as soon as it's complete, && only the rendered lines of protos
+# still waiting on their parent are kept around. the output is identical to LuaDecomp(root).getPseudoCode()
+def decompileStream(protos, dataflowLocals: bool = False) -> str:
+    results = {}
+
+    for path, chunk in protos:
+        results[path] = _decompileJob((chunk, len(path) == 0, dataflowLocals))
+        lines, indexWidth = _splice(results, path)
+
+        # the children are part of our lines now
+        for indx in range(len(chunk.protos)):
+            results.pop(path + (indx,), None)
+        results[path] = (lines, indexWidth, None)
+
+    if () not in results:
+        raise Exception("Stream ended before the root chunk!")
+
+    lines, indexWidth, _ = results[()]
+    return str(_renderLines(lines, 0, indexWidth, False))
@@ -0,0 +1,162 @@
+'''
+    lprofile.py
+
+    Opt-in profiling for the undumper, disassembler, decompiler && dumper. Once enabled, the active Profiler collects
+    stage timings (undump, disassemble, decompile, dump), call counts && cumulative time for every decompiler opcode
+    handler, && per-proto instruction counts && timings. While disabled every hook is a single None check (opcode
+    handlers aren't even wrapped), so the hooks can stay in place.
+
+    NOTE: there's one active profiler per process, it isn't meant to be shared between threads.
+'''
+
+import contextlib
+import time
+
+_active: 'Profiler' = None
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.profiler._enterStage(self.name)
+
+    def __exit__(self, *exc):
+        self.profiler._exitStage(self.name, time.perf_counter() - self.start)
+
+class Profiler:
+    def __init__(self):
+        self.stages: dict[str, list] = {} # name -> [calls, seconds]
+        self.opcodes: dict[str, list] = {} # opcode name -> [calls, seconds]
+        self.protos: list[dict] = [] # one entry per decompiled proto
+        self.__depth: dict[str, int] = {} # stages can nest (eg. decompiling child protos), only the outermost counts
+        self.__protoStack: list[float] = [] # time spent in child protos, per proto being decompiled
+        self.__wrapped: dict[int, tuple] = {} # id(handlers) -> (handlers, wrapped handlers)
+
+    def _enterStage(self, name: str) -> None:
+        self.__depth[name] = self.__depth.get(name, 0) + 1
+
+    def _exitStage(self, name: str, seconds: float) -> None:
+        self.__depth[name] -= 1
+        if self.__depth[name] == 0:
+            stat = self.stages.setdefault(name, [0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+
+    # times a stage, use as 'with profiler.stage("undump"):'
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    # wraps a handler table (see LuaDecomp.handlers) so every call is counted && timed. [names] gives each opcode's name.
+    # NOTE: CLOSURE's time includes decompiling the child proto
+    def wrapHandlers(self, handlers: list, names: list[str]) -> list:
+        # every proto asks for the same table, so only wrap it once
+        if id(handlers) in self.__wrapped:
+            return self.__wrapped[id(handlers)][1]
+
+        wrapped = []
+
+        for handler, name in zip(handlers, names):
+            if handler is None:
+                wrapped.append(None)
+                continue
+
+            stat = self.opcodes.setdefault(name, [0, 0.0])
+
+            def timed(decomp, instr, handler=handler, stat=stat):
+                start = time.perf_counter()
+                try:
+                    handler(decomp, instr)
+                finally:
+                    stat[0] += 1
+                    stat[1] += time.perf_counter() - start
+
+            wrapped.append(timed)
+
+        self.__wrapped[id(handlers)] = (handlers, wrapped) # keeps [handlers] alive, so its id can't be reused
+        return wrapped
+
+    # called around the decompilation of each proto, so we can tell its own time apart from its children's
+    def beginProto(self) -> float:
+        self.__protoStack.append(0.0)
+        return time.perf_counter()
+
+    def endProto(self, start: float, name: str, numInstrs: int) -> None:
+        total = time.perf_counter() - start
+        children = self.__protoStack.pop()
+        if len(self.__protoStack) > 0:
+            self.__protoStack[len(self.__protoStack) - 1] += total
+
+        self.protos.append({"name": name, "instructions": numInstrs, "seconds": total, "selfSeconds": total - children})
+
+    # folds another profiler's report (see report()) into this one, eg. from a worker process
+    def merge(self, report: dict) -> None:
+        for ours, theirs in ((self.stages, report["stages"]), (self.opcodes, report["opcodes"])):
+            for name, stat in theirs.items():
+                mine = ours.setdefault(name, [0, 0.0])
+                mine[0] += stat["calls"]
+                mine[1] += stat["seconds"]
+
+        self.protos.extend(report["protos"])
+
+    def report(self) -> dict:
+        stats = lambda table: {name: {"calls": s[0], "seconds": s[1]} for name, s in table.items() if s[0] > 0}
+        return {"stages": stats(self.stages), "opcodes": stats(self.opcodes), "protos": list(self.protos)}
+
+    # a human readable report. only the [topProtos] slowest protos (by their own time) are listed
+    def format(self, topProtos: int = 10) -> str:
+        out = ["==== [[stages]] ====", ""]
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda s: -s[1][1]):
+            out.append("%-12s %8d calls %10.4fs" % (name, calls, seconds))
+
+        out += ["", "==== [[opcodes]] ====", ""]
+        for name, (calls, seconds) in sorted(self.opcodes.items(), key=lambda s: -s[1][1]):
+            if calls == 0: # wrapped, but never ran
+                continue
+
+            out.append("%-12s %8d calls %10.4fs %8.2fus/call" % (name, calls, seconds, seconds * 1e6 / calls))
+
+        out += ["", "==== [[slowest protos]] ====", ""]
+        for p in sorted(self.protos, key=lambda p: -p["selfSeconds"])[:topProtos]:
+            out.append("%-24s %8d instrs %10.4fs (%.4fs total)" % (p["name"] or "<unnamed>", p["instructions"], p["selfSeconds"], p["seconds"]))
+
+        return "\n".join(out) + "\n"
+
+# ========================================[[ Global ]]=========================================
+
+def enable(profiler: Profiler = None) -> Profiler:
+    global _active
+    _active = profiler if profiler is not None else Profiler()
+    return _active
+
+def disable() -> Profiler:
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+# the profiler collecting right now, or None
+def active() -> Profiler:
+    return _active
+
+# profiles everything inside a 'with profiling() as profiler:' block
+@contextlib.contextmanager
+def profiling(profiler: Profiler = None):
+    previous = _active
+    profiler = enable(profiler)
+    try:
+        yield profiler
+    finally:
+        enable(previous) if previous is not None else disable()
+
+_NO_STAGE = contextlib.nullcontext()
+
+# times [name] on the active profiler, if there is one. use as 'with lprofile.stage("dump"):'
+def stage(name: str):
+    if _active is None:
+        return _NO_STAGE
+
+    return _active.stage(name)
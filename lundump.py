@@ -9,10 +9,16 @@
     as well as read the lundump.c source file from the Lua5.1 source.
 '''
 
+import sys
+import bisect
+import copy
 import struct
 import array
+import mmap
 from enum import IntEnum, Enum, auto
 
+import lprofile
+
 class InstructionType(Enum):
     ABC = auto(),
     ABx = auto(),
@@ -79,6 +85,9 @@ def readRKasK(rk: int):
     return (rk & ~(1 << 8))
 
 class Instruction:
+    # instructions are created by the million, so don't give each one a __dict__
+    __slots__ = ('type', 'name', 'opcode', 'A', 'B', 'C')
+
     def __init__(self, type: InstructionType, name: str) -> None:
         self.type = type
         self.name = name
@@ -87,77 +96,107 @@ class Instruction:
         self.B: int = None
         self.C: int = None
 
-    # 'RK's are special in because can be a register or a konstant. a bitflag is read to determine which
-    def __formatRK(self, rk: int) -> str:
-        if whichRK(rk):
-            return "K[" + str(readRKasK(rk)) + "]"
-        else:
-            return "R[" + str(rk) + "]"
-
     def toString(self):
-        instr = "%10s" % self.name
-        regs = ""
-
-        if self.type == InstructionType.ABC:
-            # by default, treat them as registers
-            A = "%d" % self.A
-            B = "%d" % self.B
-            C = "%d" % self.C
+        return "%10s : %s" % (self.name, _formatOperands(self.opcode, self.type, self.A, self.B, self.C))
 
-            # these opcodes have RKs for B & C
-            if self.opcode in _RKBCInstr:
-                A = "R[%d]" % self.A
-                B = self.__formatRK(self.B)
-                C = self.__formatRK(self.C)
-            elif self.opcode in _RKCInstr: # just for C
-                A = "R[%d]" % self.A
-                C = self.__formatRK(self.C)
+    def getAnnotation(self, chunk):
+        annotate = opInfo[self.opcode].annotate
+        if annotate is None:
+            return ""
 
-            regs = "%6s %6s %6s" % (A, B, C) 
-        elif self.type == InstructionType.ABx or self.type == InstructionType.AsBx:
-            A = "R[%d]" % self.A
-            B = "%d" % self.B
+        return annotate(self.A, self.B, self.C, lambda k: chunk.getConstant(k).toCode())
 
-            if self.opcode in _KBx:
-                B = "K[%d]" % self.B
+def _rebuildInstructionList(opcodes, A, B, C) -> 'InstructionList':
+    instrs = InstructionList.__new__(InstructionList)
+    instrs.opcodes, instrs.A, instrs.B, instrs.C = opcodes, A, B, C
+    return instrs
 
-            regs = "%6s %6s" % (A, B)
+# a compact struct-of-arrays instruction store. opcode, A, B && C are kept in parallel typed arrays and
+# Instruction objects are only created when indexed. B holds Bx/sBx for ABx/AsBx instructions. NOTE: the
+# Instructions handed out are copies, to modify an instruction assign it back (eg. instrs[pc] = instr)
+class InstructionList:
+    __slots__ = ('opcodes', 'A', 'B', 'C')
 
-        return "%s : %s" % (instr, regs)
+    def __reduce__(self):
+        return (_rebuildInstructionList, (self.opcodes, self.A, self.B, self.C))
 
-    def getAnnotation(self, chunk):
-        if self.opcode == Opcodes.MOVE:
-            return "move R[%d] into R[%d]" % (self.B, self.A)
-        elif self.opcode == Opcodes.LOADK:
-            return "load %s into R[%d]" % (chunk.getConstant(self.B).toCode(), self.A)
-        elif self.opcode == Opcodes.GETGLOBAL:
-            return 'move _G[%s] into R[%d]' % (chunk.getConstant(self.B).toCode(), self.A)
-        elif self.opcode == Opcodes.ADD:
-            return 'add %s to %s, place into R[%d]' % (self.__formatRK(self.C), self.__formatRK(self.B), self.A)
-        elif self.opcode == Opcodes.SUB:
-            return 'sub %s from %s, place into R[%d]' % (self.__formatRK(self.C), self.__formatRK(self.B), self.A)
-        elif self.opcode == Opcodes.MUL:
-            return 'mul %s to %s, place into R[%d]' % (self.__formatRK(self.C), self.__formatRK(self.B), self.A)
-        elif self.opcode == Opcodes.DIV:
-            return 'div %s from %s, place into R[%d]' % (self.__formatRK(self.C), self.__formatRK(self.B), self.A)
-        elif self.opcode == Opcodes.CONCAT:
-            count = self.C - self.B + 1
-            return "concat %d values from R[%d] to R[%d], store into R[%d]" % (count, self.B, self.C, self.A)
-        else:
-            return ""
+    def __init__(self):
+        self.opcodes = array.array('B')
+        self.A = array.array('B')
+        self.B = array.array('i')
+        self.C = array.array('H')
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def __getitem__(self, indx):
+        if isinstance(indx, slice):
+            return [self[i] for i in range(*indx.indices(len(self)))]
+
+        # this is read once per instruction per pass, so fill the slots directly instead of going through __init__
+        opcode = self.opcodes[indx]
+        template = instr_lookup_tbl[opcode]
+        instr = Instruction.__new__(Instruction)
+        instr.type = template.type
+        instr.name = template.name
+        instr.opcode = opcode
+        instr.A = self.A[indx]
+        instr.B = self.B[indx]
+        instr.C = self.C[indx] if template.type is InstructionType.ABC else None
+        return instr
+
+    def __setitem__(self, indx: int, instr: Instruction):
+        self.opcodes[indx] = instr.opcode
+        self.A[indx] = instr.A
+        self.B[indx] = instr.B
+        self.C[indx] = instr.C if instr.type == InstructionType.ABC else 0
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, instr: Instruction):
+        self.opcodes.append(instr.opcode)
+        self.A.append(instr.A)
+        self.B.append(instr.B)
+        self.C.append(instr.C if instr.type == InstructionType.ABC else 0)
 
 class Constant:
-    def __init__(self, type: ConstType, data) -> None:
+    # if [encoding] is given, [data] is a raw string constant which is only decoded the first time it's needed
+    def __init__(self, type: ConstType, data, encoding: str = None) -> None:
         self.type = type
-        self.data = data
+        self.encoding = encoding
+        self._data = data
+
+    @property
+    def data(self):
+        if self.encoding is not None:
+            self._data = str(self._data, self.encoding)
+            self.encoding = None
+
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.encoding = None
+
+    # keeps pickles (see lcache.SnapshotCache) small, && raw strings stay raw
+    def __reduce__(self):
+        return (_rebuildConstant, (self.type, self._data, self.encoding))
+
+    # string constants kept as raw bytes are shown as latin-1 so every byte maps to a char
+    def getText(self) -> str:
+        data = self.data
+        return str(data, 'latin-1') if isinstance(data, (bytes, bytearray)) else str(data)
 
     def toString(self):
-        return "[%s] %s" % (self.type.name, str(self.data))
+        return "[%s] %s" % (self.type.name, self.getText())
 
     # format the constant so that it is parsable by lua
     def toCode(self):
         if self.type == ConstType.STRING:
-            return "\"" + self.data + "\""
+            return "\"" + self.getText() + "\""
         elif self.type == ConstType.BOOL:
             if self.data:
                 return "true"
@@ -168,16 +207,82 @@ class Constant:
         else:
             return "nil"
 
+def _rebuildConstant(type: ConstType, data, encoding: str) -> Constant:
+    constant = Constant.__new__(Constant)
+    constant.__dict__.update(type=type, encoding=encoding, _data=data)
+    return constant
+
 class Local:
     def __init__(self, name: str, start: int, end: int):
         self.name = name
         self.start = start
         self.end = end
 
+    def __reduce__(self):
+        return (Local, (self.name, self.start, self.end))
+
+# an index over a proto's locals, answering which local is live at a PC (&& in which register) in log time. locals
+# are allocated like a stack: each one takes the next free register when it comes into scope (at its start PC) and
+# gives it back when it goes out of scope (at its end PC), so replaying them in order tells us every local's register
+class LocalIndex:
+    def __init__(self, locals: list[Local]):
+        # order by start PC (lua already writes them this way), ties keep their order
+        self.locals = sorted(locals, key=lambda l: l.start)
+        self.registers: list[int] = [] # register of each local in self.locals
+
+        active = []
+        for l in self.locals:
+            while len(active) > 0 and active[len(active) - 1].end <= l.start:
+                active.pop()
+
+            self.registers.append(len(active))
+            active.append(l)
+
+        # per register, its locals in start order: starts[reg] is searched, spans[reg] holds (end, local)
+        self.starts: dict[int, list[int]] = {}
+        self.spans: dict[int, list[tuple[int, Local]]] = {}
+        for l, reg in zip(self.locals, self.registers):
+            self.starts.setdefault(reg, []).append(l.start)
+            self.spans.setdefault(reg, []).append((l.end, l))
+
+        # the running max of end PCs lets findLocal() find the first local still alive at a PC with a bisect
+        self.maxEnds: list[int] = []
+        for l in self.locals:
+            self.maxEnds.append(max(l.end, self.maxEnds[len(self.maxEnds) - 1]) if len(self.maxEnds) > 0 else l.end)
+
+    # the local in register [reg] at [pc], or None if it's a temporary there
+    def localAt(self, reg: int, pc: int) -> Local:
+        starts = self.starts.get(reg)
+        if starts is None:
+            return None
+
+        i = bisect.bisect_right(starts, pc) - 1
+        if i < 0:
+            return None
+
+        end, l = self.spans[reg][i]
+        return l if pc < end else None
+
+    # the register [local] lives in
+    def registerOf(self, local: Local) -> int:
+        for i, l in enumerate(self.locals):
+            if l is local:
+                return self.registers[i]
+
+        return None
+
+    # the first declared local that's in scope at [pc] (its end PC included)
+    def findLocal(self, pc: int) -> Local:
+        i = bisect.bisect_left(self.maxEnds, pc)
+        if i < len(self.locals) and self.locals[i].start <= pc:
+            return self.locals[i]
+
+        return None
+
 class Chunk:
     def __init__(self) -> None:
         self.constants: list[Constant] = []
-        self.instructions: list[Instruction] = []
+        self.instructions = InstructionList()
         self.protos: list[Chunk] = []
 
         self.name: str = "Unnamed proto"
@@ -186,12 +291,23 @@ class Chunk:
         self.numUpvals: int = 0
         self.numParams: int = 0
         self.isVarg: bool = False
+        self.varargFlags: int = 0 # the raw is_vararg byte, when loaded from a dump
         self.maxStack: int = 0
 
         self.upvalues: list[str] = []
-        self.lineNums: list[int] = []
+        self.lineNums = array.array('i') # source line of every instruction, empty if the dump was stripped
         self.locals: list[Local] = []
 
+        self._lineRanges: dict[int, list[tuple[int, int]]] = None # line -> PC ranges, built by getPCRanges()
+        self._localIndex: LocalIndex = None # built by getLocalIndex()
+
+    # pickles as a flat tuple of fields to keep snapshots (see lcache.SnapshotCache) small. the lookup indexes are
+    # rebuilt on demand, so they're left out
+    def __reduce__(self):
+        return (_rebuildChunk, (self.name, self.frst_line, self.last_line, self.numUpvals, self.numParams, self.isVarg,
+                                self.varargFlags, self.maxStack, self.instructions, self.constants, self.protos,
+                                self.upvalues, self.lineNums, self.locals))
+
     def appendInstruction(self, instr: Instruction):
         self.instructions.append(instr)
 
@@ -203,41 +319,76 @@ class Chunk:
 
     def appendLine(self, line: int):
         self.lineNums.append(line)
+        self._lineRanges = None
+
+    # source line of the instruction at [pc], or None if there's no line info
+    def getLine(self, pc: int) -> int:
+        if pc < 0 or pc >= len(self.lineNums):
+            return None
+
+        return self.lineNums[pc]
+
+    # (first, last) source lines covered by the instructions from [startPC] to [endPC], or None with no line info
+    def getLineSpan(self, startPC: int, endPC: int) -> tuple[int, int]:
+        lines = self.lineNums[max(startPC, 0):endPC + 1]
+        if len(lines) == 0:
+            return None
+
+        return min(lines), max(lines)
+
+    # every run of consecutive PCs (startPC, endPC inclusive) that were compiled from source [line]
+    def getPCRanges(self, line: int) -> list[tuple[int, int]]:
+        if self._lineRanges is None:
+            ranges = {}
+            lines = self.lineNums
+            start = 0
+            for pc in range(1, len(lines) + 1):
+                if pc == len(lines) or lines[pc] != lines[start]:
+                    ranges.setdefault(lines[start], []).append((start, pc - 1))
+                    start = pc
+
+            self._lineRanges = ranges
+
+        return self._lineRanges.get(line, [])
 
     def appendLocal(self, local: Local):
         self.locals.append(local)
+        self._localIndex = None
 
     def appendUpval(self, upval: str):
         self.upvalues.append(upval)
 
+    def getLocalIndex(self) -> LocalIndex:
+        if self._localIndex is None:
+            self._localIndex = LocalIndex(self.locals)
+
+        return self._localIndex
+
+    # returns None if there's no local information (may have been stripped)
     def findLocal(self, pc: int) -> Local:
-        for l in self.locals:
-            if l.start <= pc and l.end >= pc:
-                return l
+        return self.getLocalIndex().findLocal(pc)
 
-        # there's no local information (may have been stripped)
-        return None
+    # the local held in register [reg] at [pc], if any
+    def getLocalAt(self, reg: int, pc: int) -> Local:
+        return self.getLocalIndex().localAt(reg, pc)
 
     def getConstant(self, indx: int) -> Constant:
         return self.constants[indx]
 
-    def print(self):
-        print("\n==== [[" + str(self.name) + "'s constants]] ====\n")
-        for i in range(len(self.constants)):
-            print("%d: %s" % (i, self.constants[i].toString()))
-
-        print("\n==== [[" + str(self.name) + "'s locals]] ====\n")
-        for i in range(len(self.locals)):
-            print("R[%d]: %s" % (i, self.locals[i].name))
-
-        print("\n==== [[" + str(self.name) + "'s dissassembly]] ====\n")
-        for i in range(len(self.instructions)):
-            print("[%3d] %-40s ; %s" % (i, self.instructions[i].toString(), self.instructions[i].getAnnotation(self)))
-
-        if len(self.protos) > 0:
-            print("\n==== [[" + str(self.name) + "'s protos]] ====\n")
-            for z in self.protos:
-                z.print()
+    # writes the disassembly of this proto && its children to [out] (stdout by default)
+    def print(self, out = None, compact: bool = False):
+        Disassembler(out, compact).render(self)
+
+# skips __init__, there's no point building empty fields just to replace them
+def _rebuildChunk(name, frst_line, last_line, numUpvals, numParams, isVarg, varargFlags, maxStack, instructions,
+                  constants, protos, upvalues, lineNums, locals) -> Chunk:
+    chunk = Chunk.__new__(Chunk)
+    chunk.__dict__.update(
+        name=name, frst_line=frst_line, last_line=last_line, numUpvals=numUpvals, numParams=numParams, isVarg=isVarg,
+        varargFlags=varargFlags, maxStack=maxStack, instructions=instructions, constants=constants, protos=protos,
+        upvalues=upvalues, lineNums=lineNums, locals=locals, _lineRanges=None, _localIndex=None,
+    )
+    return chunk
 
 instr_lookup_tbl = [
     Instruction(InstructionType.ABC, "MOVE"),  Instruction(InstructionType.ABx, "LOADK"), Instruction(InstructionType.ABC, "LOADBOOL"),
@@ -255,6 +406,162 @@ instr_lookup_tbl = [
     Instruction(InstructionType.ABx, "CLOSURE"), Instruction(InstructionType.ABC, "VARARG")
 ]
 
+# 'RK's are special in because can be a register or a konstant. a bitflag is read to determine which
+def _formatRK(rk: int) -> str:
+    if whichRK(rk):
+        return "K[" + str(readRKasK(rk)) + "]"
+    else:
+        return "R[" + str(rk) + "]"
+
+# the operand columns of a disassembled instruction
+def _formatOperands(opcode: int, type: InstructionType, A: int, B: int, C: int) -> str:
+    info = opInfo[opcode]
+
+    if type == InstructionType.ABC:
+        # by default, treat them as registers
+        fA = "%d" % A
+        fB = "%d" % B
+        fC = "%d" % C
+
+        # some opcodes have RKs for B && C, or just for C
+        if info.rkB:
+            fB = _formatRK(B)
+        if info.rkC:
+            fA = "R[%d]" % A
+            fC = _formatRK(C)
+
+        return "%6s %6s %6s" % (fA, fB, fC)
+    elif type == InstructionType.ABx or type == InstructionType.AsBx:
+        return "%6s %6s" % ("R[%d]" % A, ("K[%d]" if info.kBx else "%d") % B)
+
+    return ""
+
+# annotators for the disassembly, annotate(A, B, C, kcode) -> str where kcode(indx) is the constant's code
+_annotators = {
+    Opcodes.MOVE:       lambda A, B, C, kcode: "move R[%d] into R[%d]" % (B, A),
+    Opcodes.LOADK:      lambda A, B, C, kcode: "load %s into R[%d]" % (kcode(B), A),
+    Opcodes.GETGLOBAL:  lambda A, B, C, kcode: 'move _G[%s] into R[%d]' % (kcode(B), A),
+    Opcodes.ADD:        lambda A, B, C, kcode: 'add %s to %s, place into R[%d]' % (_formatRK(C), _formatRK(B), A),
+    Opcodes.SUB:        lambda A, B, C, kcode: 'sub %s from %s, place into R[%d]' % (_formatRK(C), _formatRK(B), A),
+    Opcodes.MUL:        lambda A, B, C, kcode: 'mul %s to %s, place into R[%d]' % (_formatRK(C), _formatRK(B), A),
+    Opcodes.DIV:        lambda A, B, C, kcode: 'div %s from %s, place into R[%d]' % (_formatRK(C), _formatRK(B), A),
+    Opcodes.CONCAT:     lambda A, B, C, kcode: "concat %d values from R[%d] to R[%d], store into R[%d]" % (C - B + 1, B, C, A),
+}
+
+# per-opcode operand metadata, shared by the disassembler && decompiler
+class OpInfo:
+    __slots__ = ('opcode', 'name', 'type', 'rkB', 'rkC', 'kBx', 'annotate')
+
+    def __init__(self, opcode: int, name: str, type: InstructionType, rkB: bool, rkC: bool, kBx: bool, annotate) -> None:
+        self.opcode = opcode
+        self.name = name
+        self.type = type
+        self.rkB = rkB # B is an RK
+        self.rkC = rkC # C is an RK
+        self.kBx = kBx # Bx indexes the constant table
+        self.annotate = annotate
+
+# indexed by opcode
+opInfo = [
+    OpInfo(op, t.name, t.type, op in _RKBCInstr, op in _RKBCInstr or op in _RKCInstr, op in _KBx, _annotators.get(op))
+    for op, t in enumerate(instr_lookup_tbl)
+]
+
+# returns kcode(indx) -> the code of constant [indx] in [chunk], formatting each one only once
+def _constCodes(chunk: 'Chunk'):
+    codes = {}
+
+    def kcode(indx: int) -> str:
+        code = codes.get(indx)
+        if code is None:
+            code = codes[indx] = chunk.getConstant(indx).toCode()
+        return code
+
+    return kcode
+
+# renders disassembly listings to a text stream. lines are gathered into a buffer that's only written out once it
+# grows past [bufferSize], instructions are formatted straight from the InstructionList columns && constants are
+# only formatted once per proto. in [compact] mode, only the instructions are listed as tab separated columns
+# (proto, pc, opcode, A, B, C, annotation), one row per instruction
+class Disassembler:
+    def __init__(self, out = None, compact: bool = False, bufferSize: int = 1 << 16):
+        self.out = out if out is not None else sys.stdout
+        self.compact = compact
+        self.bufferSize = bufferSize
+        self.__parts: list[str] = []
+        self.__size = 0
+
+    def __write(self, text: str) -> None:
+        self.__parts.append(text)
+        self.__size += len(text)
+
+        if self.__size >= self.bufferSize:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.__parts) > 0:
+            self.out.write("".join(self.__parts))
+            self.__parts = []
+            self.__size = 0
+
+    # renders [chunk] && all of its protos, then flushes
+    def render(self, chunk: 'Chunk') -> None:
+        with lprofile.stage("disassemble"):
+            if self.compact:
+                self.__write("proto\tpc\topcode\tA\tB\tC\tannotation\n")
+                self.__renderCompact(chunk, "0")
+            else:
+                self.__renderListing(chunk)
+
+            self.flush()
+
+    def __renderListing(self, chunk: 'Chunk') -> None:
+        write = self.__write
+        name = str(chunk.name)
+
+        write("\n==== [[" + name + "'s constants]] ====\n\n")
+        for i in range(len(chunk.constants)):
+            write("%d: %s\n" % (i, chunk.constants[i].toString()))
+
+        write("\n==== [[" + name + "'s locals]] ====\n\n")
+        for i in range(len(chunk.locals)):
+            write("R[%d]: %s\n" % (i, chunk.locals[i].name))
+
+        write("\n==== [[" + name + "'s dissassembly]] ====\n\n")
+        kcode = _constCodes(chunk)
+
+        instrs = chunk.instructions
+        ops, As, Bs, Cs = instrs.opcodes, instrs.A, instrs.B, instrs.C
+        for pc in range(len(instrs)):
+            op = ops[pc]
+            info = opInfo[op]
+            text = "%10s : %s" % (info.name, _formatOperands(op, info.type, As[pc], Bs[pc], Cs[pc]))
+            note = info.annotate(As[pc], Bs[pc], Cs[pc], kcode) if info.annotate is not None else ""
+            write("[%3d] %-40s ; %s\n" % (pc, text, note))
+
+        if len(chunk.protos) > 0:
+            write("\n==== [[" + name + "'s protos]] ====\n\n")
+            for z in chunk.protos:
+                self.__renderListing(z)
+
+    def __renderCompact(self, chunk: 'Chunk', path: str) -> None:
+        write = self.__write
+        kcode = _constCodes(chunk)
+
+        instrs = chunk.instructions
+        ops, As, Bs, Cs = instrs.opcodes, instrs.A, instrs.B, instrs.C
+        for pc in range(len(instrs)):
+            op = ops[pc]
+            info = opInfo[op]
+            C = "%d" % Cs[pc] if info.type == InstructionType.ABC else ""
+            note = info.annotate(As[pc], Bs[pc], Cs[pc], kcode) if info.annotate is not None else ""
+            if "\t" in note or "\n" in note: # string constants can break the columns
+                note = note.replace("\t", "\\t").replace("\n", "\\n")
+            write("%s\t%d\t%s\t%d\t%d\t%s\t%s\n" % (path, pc, info.name, As[pc], Bs[pc], C, note))
+
+        for i, z in enumerate(chunk.protos):
+            self.__renderCompact(z, "%s.%d" % (path, i))
+
 # at [p]osition, with [s]ize of bits
 def get_bits(num: int, p: int, s: int):
     return (num>>p) & (~((~0)<<s))
@@ -282,6 +589,49 @@ def _decode_instr(data: int) -> Instruction:
 
     return instr
 
+# array typecode for a native u32 (on most hosts this is 'I', but we can't rely on it)
+_U32_TYPECODE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# array typecodes for native signed ints, by size
+_INT_TYPECODES = {array.array(t).itemsize: t for t in 'qlih'}
+
+# per opcode, the bit position B is read from && the bias it's stored with (ABx/AsBx take Bx in place of B)
+_B_SHIFTS = [23 if t.type == InstructionType.ABC else 14 for t in instr_lookup_tbl] # POS_B (23), POS_Bx (14)
+_B_BIASES = [131071 if t.type == InstructionType.AsBx else 0 for t in instr_lookup_tbl]
+
+# decodes a whole block of raw instruction words at once, in a single pass over the words
+def _decode_instrs(words: array.array) -> InstructionList:
+    instrs = InstructionList()
+    addOp, addA, addB, addC = instrs.opcodes.append, instrs.A.append, instrs.B.append, instrs.C.append
+    shifts, biases = _B_SHIFTS, _B_BIASES
+
+    try:
+        for w in words:
+            op = w & 0x3F # POS_OP (0), SIZE_OP (6)
+            addOp(op)
+            addA((w >> 6) & 0xFF) # POS_A (6), SIZE_A (8)
+            addB((w >> shifts[op]) - biases[op]) # B && Bx are the top bits, so shifting is enough
+            addC((w >> 14) & 0x1FF) # POS_C (14), SIZE_C (9)
+    except IndexError:
+        raise Exception("Unknown opcode! [%d]" % (words[len(instrs.opcodes) - 1] & 0x3F))
+
+    return instrs
+
+# the inverse of _decode_instrs(), encodes a whole InstructionList into raw u32 words (in host byte order) at once
+def _encode_instrs(instrs: InstructionList) -> array.array:
+    # per opcode, the bit position B goes to, the bias it's stored with && the widths of B && C. ABx/AsBx
+    # instructions have no C (the decoder leaves Bx's low bits in it), Bx takes its place
+    isABC = [t.type == InstructionType.ABC for t in instr_lookup_tbl]
+    shifts = [23 if abc else 14 for abc in isABC]
+    biases = [131071 if t.type == InstructionType.AsBx else 0 for t in instr_lookup_tbl]
+    bMasks = [0x1FF if abc else 0x3FFFF for abc in isABC]
+    cMasks = [0x1FF if abc else 0 for abc in isABC]
+
+    return array.array(_U32_TYPECODE, [
+        op | ((a & 0xFF) << 6) | ((c & cMasks[op]) << 14) | (((b + biases[op]) & bMasks[op]) << shifts[op])
+        for op, a, b, c in zip(instrs.opcodes, instrs.A, instrs.B, instrs.C)
+    ])
+
 # returns a u32 instruction
 def _encode_instr(instr: Instruction) -> int:
     data = 0
@@ -300,62 +650,274 @@ def _encode_instr(instr: Instruction) -> int:
 
     return data
 
+# struct format characters for each of the integer sizes we support in the chunk header
+_UINT_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+_INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+_FLOAT_FORMATS = {4: 'f', 8: 'd'}
+
+# builds a precompiled struct for an unsigned int of [sz] bytes
+def _uintStruct(order: str, sz: int) -> struct.Struct:
+    if sz not in _UINT_FORMATS:
+        raise Exception("Unsupported integer size! [%d]" % sz)
+
+    return struct.Struct(order + _UINT_FORMATS[sz])
+
+# builds a precompiled struct for a lua_Number of [sz] bytes
+def _numberStruct(order: str, sz: int, integral: bool) -> struct.Struct:
+    formats = _INT_FORMATS if integral else _FLOAT_FORMATS
+    if sz not in formats:
+        raise Exception("Unsupported lua_Number size! [%d]" % sz)
+
+    return struct.Struct(order + formats[sz])
+
+# how many bytes we read from a file object at a time while streaming
+_STREAM_BUFFER_SIZE = 64 * 1024
+
+# the byte order && data sizes a dump was compiled with, as given in its header
+class HeaderProfile:
+    __slots__ = ('big_endian', 'int_size', 'size_t', 'instr_size', 'l_number_size', 'integral_flag')
+
+    def __init__(self, big_endian: bool = False, int_size: int = 4, size_t: int = 8, instr_size: int = 4,
+                 l_number_size: int = 8, integral_flag: bool = False):
+        self.big_endian = big_endian
+        self.int_size = int_size
+        self.size_t = size_t
+        self.instr_size = instr_size
+        self.l_number_size = l_number_size
+        self.integral_flag = integral_flag
+
+    # copies the profile onto a LuaUndump/LuaDump (or anything else with the same header attributes)
+    def applyTo(self, target) -> None:
+        for name in self.__slots__:
+            setattr(target, name, getattr(self, name))
+
+    @staticmethod
+    def of(source) -> 'HeaderProfile':
+        return HeaderProfile(*(getattr(source, name) for name in HeaderProfile.__slots__))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, HeaderProfile) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self) -> str:
+        return "HeaderProfile(%s)" % ", ".join("%s=%r" % (n, getattr(self, n)) for n in self.__slots__)
+
+# common targets, by name
+PROFILES = {
+    "x86":      HeaderProfile(False, 4, 4, 4, 8, False), # 32 bit little endian
+    "x64":      HeaderProfile(False, 4, 8, 4, 8, False), # 64 bit little endian (the default LuaDump writes)
+    "ppc":      HeaderProfile(True, 4, 4, 4, 8, False), # 32 bit big endian (consoles, older macs)
+    "ppc64":    HeaderProfile(True, 4, 8, 4, 8, False),
+    "float32":  HeaderProfile(False, 4, 4, 4, 4, False), # embedded builds with lua_Number as a float
+    "int32":    HeaderProfile(False, 4, 4, 4, 4, True), # embedded builds with lua_Number as an int
+}
+
+# where a proto lives in a dump: the byte [offset] it starts at, its [size] (child protos included) && the spans of
+# its child protos
+class ProtoSpan:
+    __slots__ = ('offset', 'size', 'protos')
+
+    def __init__(self, offset: int, size: int, protos: list['ProtoSpan']):
+        self.offset = offset
+        self.size = size
+        self.protos = protos
+
+# a Chunk's protos, each one decoded from the dump the first time it's accessed (see LuaUndump.decode_lazy()). it
+# acts like a plain list, iterating over it (or searching it) decodes everything
+class LazyProtoList(list):
+    def __init__(self, source: 'LuaUndump', spans: list[ProtoSpan]):
+        super().__init__([None] * len(spans))
+        self._source = source
+        self._spans = spans
+
+    def _load(self, indx: int) -> 'Chunk':
+        proto = list.__getitem__(self, indx)
+        if proto is None:
+            proto = self._source._decode_lazy_chunk(self._spans[indx])
+            list.__setitem__(self, indx, proto)
+
+        return proto
+
+    # has proto [indx] been decoded yet?
+    def isLoaded(self, indx: int) -> bool:
+        return list.__getitem__(self, indx) is not None
+
+    def __getitem__(self, indx):
+        if isinstance(indx, slice):
+            return [self._load(i) for i in range(*indx.indices(len(self)))]
+
+        return self._load(indx + len(self) if indx < 0 else indx)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._load(i)
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self._load(i)
+
+    def __contains__(self, proto) -> bool:
+        return any(p is proto or p == proto for p in self)
+
+    # pickles (&& copies) as a plain list, decoding everything
+    def __reduce__(self):
+        return (list, (list(self),))
+
+# just enough of a proto for its parent to be analyzed without it (CLOSURE needs to know how many upvalues it has).
+# stubs have no instructions, which real protos always do (at least the final RETURN)
+def protoStub(chunk: Chunk) -> Chunk:
+    stub = Chunk()
+    stub.numUpvals = chunk.numUpvals
+    return stub
+
+def isProtoStub(chunk: Chunk) -> bool:
+    return len(chunk.instructions) == 0
+
 class LuaUndump:
-    def __init__(self):
+    # [stringEncoding] is the codec used for string constants, pass None to keep them as raw bytes. if [lazyStrings]
+    # is set, string constants are kept as bytes && only decoded once something actually reads them
+    def __init__(self, stringEncoding: str = 'latin-1', lazyStrings: bool = False):
         self.rootChunk: Chunk = None
+        self.bytecode = None
         self.index = 0
+        self.stringEncoding = stringEncoding
+        self.lazyStrings = lazyStrings
+
+        # only set while streaming (see stream_chunks())
+        self._stream = None
+
+        # the spans of every proto, set by scan_bytecode() && decode_lazy()
+        self.protoIndex: ProtoSpan = None
+        self.bufferSize = _STREAM_BUFFER_SIZE
+
+    # precompile our struct readers once we know the endianness && data sizes from the header
+    def _compileStructs(self):
+        order = '>' if self.big_endian else '<'
+        self._uint32 = _uintStruct(order, 4)
+        self._uint = _uintStruct(order, self.int_size)
+        self._sizet = _uintStruct(order, self.size_t)
+        self._number = _numberStruct(order, self.l_number_size, self.integral_flag)
+
+    # returns a zero-copy view of the next [sz] bytes
+    # called when the next [sz] bytes aren't in self.bytecode. when streaming this refills our buffer, otherwise
+    # the dump is truncated
+    def _underflow(self, sz: int):
+        if self._stream is None:
+            raise Exception("Malformed bytecode!")
 
-    def _loadBlock(self, sz) -> bytearray:
+        # keep whatever we haven't consumed yet, then read at least another buffer's worth
+        buffered = [bytes(self.bytecode[self.index:])]
+        size = len(buffered[0])
+        want = max(self.bufferSize, sz - size)
+        while size < sz:
+            data = self._stream.read(want)
+            if not data:
+                raise Exception("Malformed bytecode!")
+
+            buffered.append(data)
+            size += len(data)
+            want -= len(data)
+
+        # NOTE: we swap in a new buffer rather than resizing the old one, since views of it might still be alive
+        self.bytecode = memoryview(b"".join(buffered))
+        self.index = 0
+
+    def _loadBlock(self, sz) -> memoryview:
         if self.index + sz > len(self.bytecode):
-            raise Exception("Malformed bytecode!")
+            self._underflow(sz)
 
-        temp = bytearray(self.bytecode[self.index:self.index+sz])
+        temp = self.bytecode[self.index:self.index+sz]
         self.index = self.index + sz
         return temp
 
+    # decodes the next value in place using a precompiled struct
+    def _unpack(self, packer: struct.Struct):
+        if self.index + packer.size > len(self.bytecode):
+            self._underflow(packer.size)
+
+        val = packer.unpack_from(self.bytecode, self.index)[0]
+        self.index = self.index + packer.size
+        return val
+
     def _get_byte(self) -> int:
-        return self._loadBlock(1)[0]
+        if self.index >= len(self.bytecode):
+            self._underflow(1)
+
+        self.index = self.index + 1
+        return self.bytecode[self.index - 1]
 
     def _get_uint32(self) -> int:
-        order = 'big' if self.big_endian else 'little'
-        return int.from_bytes(self._loadBlock(4), byteorder=order, signed=False)
+        return self._unpack(self._uint32)
 
     def _get_uint(self) -> int:
-        order = 'big' if self.big_endian else 'little'
-        return int.from_bytes(self._loadBlock(self.int_size), byteorder=order, signed=False)
+        return self._unpack(self._uint)
 
     def _get_size_t(self) -> int:
-        order = 'big' if self.big_endian else 'little'
-        return int.from_bytes(self._loadBlock(self.size_t), byteorder=order, signed=False)
+        return self._unpack(self._sizet)
 
-    def _get_double(self) -> int:
-        order = '>d' if self.big_endian else '<d'
-        return struct.unpack(order, self._loadBlock(self.l_number_size))[0]
+    def _get_double(self) -> float:
+        return self._unpack(self._number)
 
-    def _get_string(self) -> str:
+    # reads [num] instructions in one go as an array of u32 words in host byte order
+    def _get_instr_block(self, num: int) -> array.array:
+        words = array.array(_U32_TYPECODE)
+        words.frombytes(self._loadBlock(num * 4))
+
+        if self.big_endian != (sys.byteorder == 'big'):
+            words.byteswap()
+
+        return words
+
+    # reads [num] ints (int_size bytes each) in one go, as an array in host byte order
+    def _get_int_block(self, num: int) -> array.array:
+        if self.int_size not in _INT_TYPECODES:
+            raise Exception("Unsupported integer size! [%d]" % self.int_size)
+
+        ints = array.array(_INT_TYPECODES[self.int_size])
+        ints.frombytes(self._loadBlock(num * self.int_size))
+
+        if self.big_endian != (sys.byteorder == 'big'):
+            ints.byteswap()
+
+        return ints
+
+    # reads a string without its NULL terminator, as a view into the bytecode
+    def _get_raw_string(self) -> memoryview:
         size = self._get_size_t()
         if (size == 0):
-            return ""
+            return self.bytecode[0:0]
 
         # [:-1] to remove the NULL terminator
-        return ("".join(chr(x) for x in self._loadBlock(size)))[:-1]
+        return self._loadBlock(size)[:-1]
 
-    def decode_chunk(self) -> Chunk:
-        chunk = Chunk()
+    # names (chunk source, locals, upvalues) are always decoded, even if constants are kept raw
+    def _get_string(self) -> str:
+        return str(self._get_raw_string(), self.stringEncoding or 'latin-1')
+
+    def _get_string_constant(self) -> Constant:
+        raw = self._get_raw_string()
+
+        if self.stringEncoding is None:
+            return Constant(ConstType.STRING, bytes(raw))
+        elif self.lazyStrings:
+            return Constant(ConstType.STRING, bytes(raw), self.stringEncoding)
+        else:
+            return Constant(ConstType.STRING, str(raw, self.stringEncoding))
 
+    # meta info, instructions && constants. everything that comes before the child protos
+    def _decode_chunk_head(self, chunk: Chunk):
         # chunk meta info
         chunk.name = self._get_string()
         chunk.frst_line = self._get_uint()
         chunk.last_line = self._get_uint()
         chunk.numUpvals = self._get_byte()
         chunk.numParams = self._get_byte()
-        chunk.isVarg = (self._get_byte() != 0)
+        chunk.varargFlags = self._get_byte()
+        chunk.isVarg = (chunk.varargFlags != 0)
         chunk.maxStack = self._get_byte()
 
         # parse instructions
         num = self._get_uint()
-        for i in range(num):
-            chunk.appendInstruction(_decode_instr(self._get_uint32()))
+        chunk.instructions = _decode_instrs(self._get_instr_block(num))
 
         # get constants
         num = self._get_uint()
@@ -370,24 +932,17 @@ class LuaUndump:
             elif type == 3: # number
                 constant = Constant(ConstType.NUMBER, self._get_double())
             elif type == 4: # string
-                constant = Constant(ConstType.STRING, self._get_string())
+                constant = self._get_string_constant()
             else:
                 raise Exception("Unknown Datatype! [%d]" % type)
 
             chunk.appendConstant(constant)
 
-        # parse protos
-        num = self._get_uint()
-        for i in range(num):
-            chunk.appendProto(self.decode_chunk())
-
-        # debug stuff, maybe i'll add this to chunks to have better disassembly annotation in the future?
-        # eh, for now just consume the bytes.
-
+    # debug info, everything that comes after the child protos
+    def _decode_chunk_debug(self, chunk: Chunk):
         # line numbers
         num = self._get_uint()
-        for i in range(num):
-            self._get_uint()
+        chunk.lineNums = self._get_int_block(num)
 
         # locals
         num = self._get_uint()
@@ -402,22 +957,131 @@ class LuaUndump:
         for i in range(num):
             chunk.appendUpval(self._get_string()) # upvalue name
 
+    def decode_chunk(self) -> Chunk:
+        chunk = Chunk()
+        self._decode_chunk_head(chunk)
+
+        # parse protos
+        num = self._get_uint()
+        for i in range(num):
+            chunk.appendProto(self.decode_chunk())
+
+        self._decode_chunk_debug(chunk)
         return chunk
 
+    # generator version of decode_chunk(), yields (path, chunk) for every proto as soon as it's complete. children
+    # are finished before their parents, so the root chunk (path ()) is always yielded last
+    def _stream_chunk(self, path: tuple, keepProtos: bool):
+        chunk = Chunk()
+        self._decode_chunk_head(chunk)
+
+        # parse protos
+        num = self._get_uint()
+        for i in range(num):
+            proto = yield from self._stream_chunk(path + (i,), keepProtos)
+            chunk.appendProto(proto if keepProtos else protoStub(proto))
+
+        self._decode_chunk_debug(chunk)
+        yield path, chunk
+        return chunk
+
+    # ========================================[[ Lazy ]]==========================================
+
+    def _skip(self, sz: int):
+        if self.index + sz > len(self.bytecode):
+            raise Exception("Malformed bytecode!")
+
+        self.index = self.index + sz
+
+    def _skip_string(self):
+        self._skip(self._get_size_t())
+
+    # walks the proto at self.index without decoding anything (instructions && line info are skipped over in one
+    # go), just to find where it && its children are
+    def _scan_chunk(self) -> ProtoSpan:
+        start = self.index
+        u = self.int_size
+
+        # meta info && instructions
+        self._skip_string()
+        self._skip((u * 2) + 4)
+        self._skip(self._get_uint() * 4)
+
+        # constants
+        for i in range(self._get_uint()):
+            type = self._get_byte()
+            if type == 1: # bool
+                self._skip(1)
+            elif type == 3: # number
+                self._skip(self.l_number_size)
+            elif type == 4: # string
+                self._skip_string()
+            elif type != 0:
+                raise Exception("Unknown Datatype! [%d]" % type)
+
+        protos = [self._scan_chunk() for i in range(self._get_uint())]
+
+        # line numbers, locals && upvalues
+        self._skip(self._get_uint() * u)
+        for i in range(self._get_uint()):
+            self._skip_string()
+            self._skip(u * 2)
+        for i in range(self._get_uint()):
+            self._skip_string()
+
+        return ProtoSpan(start, self.index - start, protos)
+
+    # decodes the proto at [span] with its own reader (so any number of them can be loaded, in any order). its
+    # child protos are left to load on demand
+    def _decode_lazy_chunk(self, span: ProtoSpan) -> Chunk:
+        with lprofile.stage("undump"):
+            reader = copy.copy(self)
+            reader.index = span.offset
+
+            chunk = Chunk()
+            reader._decode_chunk_head(chunk)
+            reader._get_uint() # number of protos, we already have their spans
+            chunk.protos = LazyProtoList(self, span.protos)
+
+            # the debug info comes after the last child proto
+            if len(span.protos) > 0:
+                last = span.protos[len(span.protos) - 1]
+                reader.index = last.offset + last.size
+
+            reader._decode_chunk_debug(chunk)
+            return chunk
+
+    # finds the offset && size of every proto in [bytecode] without decoding any of them. returns the root's span
+    def scan_bytecode(self, bytecode) -> ProtoSpan:
+        self.bytecode = memoryview(bytecode).cast('B')
+        if not bytes(self.bytecode[0:4]) == _LUAMAGIC:
+            raise Exception("Lua Bytecode expected!")
+
+        self.index = 4
+        self._decode_header()
+        self.protoIndex = self._scan_chunk()
+        return self.protoIndex
+
+    # like decode_rawbytecode(), except protos are only decoded once they're accessed (see LazyProtoList). after a
+    # quick pre-scan of the dump (see scan_bytecode(), the result is kept in self.protoIndex) only the root chunk
+    # is decoded. NOTE: [bytecode] has to stay alive && unchanged for as long as the chunks are used
+    def decode_lazy(self, bytecode) -> Chunk:
+        with lprofile.stage("undump"):
+            self.scan_bytecode(bytecode)
+
+            # protos are decoded by a snapshot of this reader, so we're free to load other dumps in the meantime
+            source = copy.copy(self)
+            self.rootChunk = source._decode_lazy_chunk(self.protoIndex)
+            return self.rootChunk
+
     def decode_rawbytecode(self, rawbytecode):
         # bytecode sanity checks
         if not rawbytecode[0:4] == _LUAMAGIC:
             raise Exception("Lua Bytecode expected!")
 
-        bytecode = array.array('b', rawbytecode)
-        return self.decode_bytecode(bytecode)
-
-    def decode_bytecode(self, bytecode):
-        self.bytecode = bytecode
-
-        # aligns index, skips header
-        self.index = 4
+        return self.decode_bytecode(rawbytecode)
 
+    def _decode_header(self):
         self.vm_version = self._get_byte()
         self.bytecode_format = self._get_byte()
         self.big_endian = (self._get_byte() == 0)
@@ -427,21 +1091,103 @@ class LuaUndump:
         self.l_number_size = self._get_byte() # size of lua_Number
         self.integral_flag = self._get_byte() # is lua_Number defined as an int? false = float/double, true = int/long/short/etc.
 
-        self.rootChunk = self.decode_chunk()
-        return self.rootChunk
-        
-    def loadFile(self, luaCFile):
+        if self.instr_size != 4:
+            raise Exception("Unsupported instruction size! [%d]" % self.instr_size)
+
+        self._compileStructs()
+
+    # the profile of the last dump we read
+    def getProfile(self) -> HeaderProfile:
+        return HeaderProfile.of(self)
+
+    def decode_bytecode(self, bytecode):
+        with lprofile.stage("undump"):
+            # view the bytecode as unsigned bytes, no matter what buffer we were handed (bytes, bytearray, array, mmap, etc.)
+            self.bytecode = memoryview(bytecode).cast('B')
+
+            # aligns index, skips header
+            self.index = 4
+
+            self._decode_header()
+            self.rootChunk = self.decode_chunk()
+            return self.rootChunk
+
+    # incrementally decodes a dump from a binary file object, only ever holding about [bufferSize] bytes of it at a
+    # time. yields (path, chunk) for every proto as soon as it's parsed, where path is the tuple of proto indexes
+    # leading to it from the root chunk (so the root is () and its first child is (0,)). unless [keepProtos] is set,
+    # finished protos are replaced by stubs (see protoStub()) in their parent's protos list, so they can be freed
+    # once the caller is done. parents holding stubs can't be decompiled on their own, use lparser.decompileStream()
+    def stream_chunks(self, luac_file, keepProtos: bool = False, bufferSize: int = _STREAM_BUFFER_SIZE):
+        self._stream = luac_file
+        self.bufferSize = bufferSize
+        self.bytecode = memoryview(b"")
+        self.index = 0
+
+        try:
+            # bytecode sanity checks
+            if not bytes(self._loadBlock(4)) == _LUAMAGIC:
+                raise Exception("Lua Bytecode expected!")
+
+            self._decode_header()
+            self.rootChunk = yield from self._stream_chunk((), keepProtos)
+        finally:
+            self._stream = None
+            self.bytecode = None
+
+    def streamFile(self, luaCFile, keepProtos: bool = False, bufferSize: int = _STREAM_BUFFER_SIZE):
         with open(luaCFile, 'rb') as luac_file:
-            bytecode = luac_file.read()
-            return self.decode_rawbytecode(bytecode)
+            yield from self.stream_chunks(luac_file, keepProtos, bufferSize)
+
+    # with [lazy], protos are only decoded once they're accessed (see decode_lazy()). the file stays mapped for as
+    # long as the chunks are alive
+    def loadFile(self, luaCFile, lazy: bool = False):
+        with open(luaCFile, 'rb') as luac_file:
+            # mmap the file so we never have to copy the whole dump into memory. empty files can't be mapped
+            try:
+                bytecode = mmap.mmap(luac_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                bytecode = luac_file.read()
+
+            if lazy:
+                return self.decode_lazy(bytecode)
+
+            if not isinstance(bytecode, mmap.mmap):
+                return self.decode_rawbytecode(bytecode)
+
+            try:
+                return self.decode_rawbytecode(bytecode)
+            finally:
+                # mmaps can't be closed while we still have a view exported, so drop ours first
+                if isinstance(self.bytecode, memoryview):
+                    self.bytecode.release()
+                self.bytecode = None
+                bytecode.close()
 
     def print_dissassembly(self):
         self.rootChunk.print()
 
+# converts a lua_Number for a dump whose numbers are integral (or not)
+def _toNumber(num, integral: bool):
+    if not integral:
+        return float(num)
+
+    if not float(num).is_integer():
+        raise Exception("Can't store a non-integral number! [%g]" % num)
+
+    return int(num)
+
+# is_vararg flags, see lobject.h
+_VARARG_ISVARARG = 2
+
 class LuaDump:
-    def __init__(self, rootChunk: Chunk):
+    # [stringEncoding] is the codec used to encode str strings, raw (bytes) strings are written untouched. it has to
+    # match the codec the chunk was undumped with (latin-1 for both by default, which maps every byte to itself).
+    # str strings the codec can't encode (like ones built by hand with chars past U+00FF) are written as utf-8
+    # [profile] picks the byte order && data sizes to write (see PROFILES), the default is PROFILES["x64"]
+    def __init__(self, rootChunk: Chunk, stringEncoding: str = 'latin-1', profile: HeaderProfile = None):
         self.rootChunk = rootChunk
         self.bytecode = bytearray()
+        self.stringEncoding = stringEncoding
 
         # header info
         self.vm_version = 0x51
@@ -455,103 +1201,234 @@ class LuaDump:
         self.l_number_size = 8
         self.integral_flag = False # lua_Number is a double
 
-    def _writeBlock(self, data: bytes):
-        self.bytecode += bytearray(data)
+        if profile is not None:
+            profile.applyTo(self)
 
-    def _set_byte(self, b: int):
-        self.bytecode.append(b)
+        self._strings: list[bytes] = []
 
-    def _set_uint32(self, i: int):
-        order = 'big' if self.big_endian else 'little'
-        self._writeBlock(i.to_bytes(4, order, signed=False))
+    def _compileStructs(self):
+        if self.instr_size != 4:
+            raise Exception("Unsupported instruction size! [%d]" % self.instr_size)
 
-    def _set_uint(self, i: int):
-        order = 'big' if self.big_endian else 'little'
-        self._writeBlock(i.to_bytes(self.int_size, order, signed=False))
+        if self.int_size not in _INT_TYPECODES:
+            raise Exception("Unsupported integer size! [%d]" % self.int_size)
 
-    def _set_size_t(self, i: int):
-        order = 'big' if self.big_endian else 'little'
-        self._writeBlock(i.to_bytes(self.size_t, order, signed=False))
+        order = '>' if self.big_endian else '<'
+        self._uint = _uintStruct(order, self.int_size)
+        self._sizet = _uintStruct(order, self.size_t)
+        self._number = _numberStruct(order, self.l_number_size, self.integral_flag)
+        self._swap = self.big_endian != (sys.byteorder == 'big')
 
-    def _set_double(self, f: float):
-        order = '>d' if self.big_endian else '<d'
-        self._writeBlock(struct.pack(order, f))
+    # ========================================[[ Sizing ]]=========================================
+    # the first pass works out how big the dump is so it can be written into one preallocated buffer. strings are
+    # encoded here, once, in the same order the second pass writes them
+
+    # raw (bytes) strings are written as-is
+    def _sizeString(self, string) -> int:
+        if not isinstance(string, (bytes, bytearray)):
+            try:
+                string = string.encode(self.stringEncoding)
+            except UnicodeEncodeError:
+                string = string.encode('utf-8')
+
+        self._strings.append(string)
+        return self.size_t + len(string) + 1 # + null terminator
+
+    def _sizeChunk(self, chunk: Chunk) -> int:
+        u = self.int_size
+
+        # meta info && instructions
+        size = self._sizeString(chunk.name) + (u * 2) + 4
+        size += u + (4 * len(chunk.instructions))
+
+        # constants
+        size += u
+        for constant in chunk.constants:
+            size += 1
+            if constant.type == ConstType.BOOL:
+                size += 1
+            elif constant.type == ConstType.NUMBER:
+                size += self.l_number_size
+            elif constant.type == ConstType.STRING:
+                size += self._sizeString(constant.data)
+            elif constant.type != ConstType.NIL:
+                raise Exception("Unknown Datatype! [%s]" % str(constant.type))
+
+        # child protos
+        size += u
+        for p in chunk.protos:
+            size += self._sizeChunk(p)
+
+        # debug info
+        size += u + (u * len(chunk.lineNums))
+        size += u
+        for l in chunk.locals:
+            size += self._sizeString(l.name) + (u * 2)
+        size += u
+        for up in chunk.upvalues:
+            size += self._sizeString(up)
 
-    def _set_string(self, string: str):
-        self._set_size_t(len(string)+1)
-        self._writeBlock(string.encode('utf-8'))
-        self._set_byte(0x00) # write null terminator
+        return size
+
+    # returns the size of the whole dump, && gets the strings ready for _packChunk()
+    def _prepare(self) -> int:
+        self._compileStructs()
+        self._strings = []
+        self._nextString = 0
+
+        return len(_LUAMAGIC) + 8 + self._sizeChunk(self.rootChunk)
+
+    # ========================================[[ Packing ]]========================================
+    # the second pass writes everything straight into the buffer with precompiled structs. every _pack* method
+    # returns the offset just past what it wrote
+
+    def _packString(self, buf, off: int) -> int:
+        string = self._strings[self._nextString]
+        self._nextString += 1
+
+        self._sizet.pack_into(buf, off, len(string) + 1)
+        off += self.size_t
+        buf[off:off + len(string)] = string
+        off += len(string)
+        buf[off] = 0x00 # null terminator
+
+        return off + 1
+
+    # copies an array of host ints into the buffer in our byte order
+    def _packArray(self, buf, off: int, data: array.array) -> int:
+        if self._swap:
+            data = array.array(data.typecode, data)
+            data.byteswap()
+
+        raw = memoryview(data).cast('B')
+        buf[off:off + len(raw)] = raw
+
+        return off + len(raw)
+
+    def _packChunk(self, buf, off: int, chunk: Chunk) -> int:
+        uint, u = self._uint, self.int_size
 
-    def _dumpChunk(self, chunk: Chunk):
         # write meta info
-        self._set_string(chunk.name)
-        self._set_uint(chunk.frst_line)
-        self._set_uint(chunk.last_line)
-        self._set_byte(chunk.numUpvals)
-        self._set_byte(chunk.numParams)
-        self._set_byte(1 if chunk.isVarg else 1)
-        self._set_byte(chunk.maxStack)
+        off = self._packString(buf, off)
+        uint.pack_into(buf, off, chunk.frst_line)
+        uint.pack_into(buf, off + u, chunk.last_line)
+        off += u * 2
+
+        # keep the original is_vararg flags if we have them
+        varargFlags = chunk.varargFlags if chunk.isVarg and chunk.varargFlags != 0 else (_VARARG_ISVARARG if chunk.isVarg else 0)
+        buf[off:off + 4] = bytes((chunk.numUpvals, chunk.numParams, varargFlags, chunk.maxStack))
+        off += 4
 
         # write instructions
-        self._set_uint(len(chunk.instructions))
-        for l in chunk.instructions:
-            self._set_uint32(_encode_instr(l))
+        uint.pack_into(buf, off, len(chunk.instructions))
+        off = self._packArray(buf, off + u, _encode_instrs(chunk.instructions))
 
         # write constants
-        self._set_uint(len(chunk.constants))
+        uint.pack_into(buf, off, len(chunk.constants))
+        off += u
         for constant in chunk.constants:
-            # write constant data
             if constant.type == ConstType.NIL:
-                self._set_byte(0)
+                buf[off] = 0
+                off += 1
             elif constant.type == ConstType.BOOL:
-                self._set_byte(1)
-                self._set_byte(1 if constant.data else 0)
+                buf[off] = 1
+                buf[off + 1] = 1 if constant.data else 0
+                off += 2
             elif constant.type == ConstType.NUMBER: # number
-                self._set_byte(3)
-                self._set_double(constant.data)
+                buf[off] = 3
+                self._number.pack_into(buf, off + 1, _toNumber(constant.data, self.integral_flag))
+                off += 1 + self.l_number_size
             elif constant.type == ConstType.STRING: # string
-                self._set_byte(4)
-                self._set_string(constant.data)
-            else:
-                raise Exception("Unknown Datatype! [%s]" % str(constant.type))
+                buf[off] = 4
+                off = self._packString(buf, off + 1)
 
         # write child protos
-        self._set_uint(len(chunk.protos))
+        uint.pack_into(buf, off, len(chunk.protos))
+        off += u
         for p in chunk.protos:
-            self._dumpChunk(p)
+            off = self._packChunk(buf, off, p)
 
         # write line numbers
-        self._set_uint(len(chunk.lineNums))
-        for l in chunk.lineNums:
-            self._set_uint(l)
+        uint.pack_into(buf, off, len(chunk.lineNums))
+        lines = chunk.lineNums
+        if not isinstance(lines, array.array) or lines.typecode != _INT_TYPECODES[u]:
+            lines = array.array(_INT_TYPECODES[u], lines)
+        off = self._packArray(buf, off + u, lines)
 
         # write locals
-        self._set_uint(len(chunk.locals))
+        uint.pack_into(buf, off, len(chunk.locals))
+        off += u
         for l in chunk.locals:
-            self._set_string(l.name)
-            self._set_uint(l.start)
-            self._set_uint(l.end)
+            off = self._packString(buf, off)
+            uint.pack_into(buf, off, l.start)
+            uint.pack_into(buf, off + u, l.end)
+            off += u * 2
 
         # write upvals
-        self._set_uint(len(chunk.upvalues))
-        for u in chunk.upvalues:
-            self._set_string(u)
+        uint.pack_into(buf, off, len(chunk.upvalues))
+        off += u
+        for _ in chunk.upvalues:
+            off = self._packString(buf, off)
+
+        return off
 
-    def _dumpHeader(self):
-        self._writeBlock(_LUAMAGIC)
+    def _packHeader(self, buf, off: int) -> int:
+        buf[off:off + len(_LUAMAGIC)] = _LUAMAGIC
+        off += len(_LUAMAGIC)
 
         # write header info
-        self._set_byte(self.vm_version)
-        self._set_byte(self.bytecode_format)
-        self._set_byte(0 if self.big_endian else 1)
-        self._set_byte(self.int_size)
-        self._set_byte(self.size_t)
-        self._set_byte(self.instr_size)
-        self._set_byte(self.l_number_size)
-        self._set_byte(self.integral_flag)
+        buf[off:off + 8] = bytes((self.vm_version, self.bytecode_format, 0 if self.big_endian else 1, self.int_size,
+                                  self.size_t, self.instr_size, self.l_number_size, 1 if self.integral_flag else 0))
 
-    def dump(self) -> bytearray:
-        self._dumpHeader()
-        self._dumpChunk(self.rootChunk)
+        return off + 8
+
+    def _packInto(self, buf, off: int, size: int) -> int:
+        end = self._packChunk(buf, self._packHeader(buf, off), self.rootChunk)
+        self._strings = []
 
-        return self.bytecode
\ No newline at end of file
+        if end - off != size:
+            raise Exception("Dump size mismatch! [%d != %d]" % (end - off, size))
+
+        return end
+
+    # ========================================[[ Output ]]=========================================
+
+    # the size of the dump in bytes
+    def dumpSize(self) -> int:
+        size = self._prepare()
+        self._strings = []
+        return size
+
+    def dump(self) -> bytearray:
+        with lprofile.stage("dump"):
+            size = self._prepare()
+            self.bytecode = bytearray(size)
+            self._packInto(self.bytecode, 0, size)
+
+        return self.bytecode
+
+    # writes the dump into any writable buffer (bytearray, mmap, memoryview, ...) at [offset], which has to have
+    # room for dumpSize() bytes. returns the offset just past the dump
+    def dumpInto(self, buffer, offset: int = 0) -> int:
+        with lprofile.stage("dump"):
+            size = self._prepare()
+            if offset + size > len(buffer):
+                raise Exception("Buffer too small! [%d < %d]" % (len(buffer) - offset, size))
+
+            return self._packInto(buffer, offset, size)
+
+    # writes the dump to [path] through an mmap of the file, so it's never assembled in memory first
+    def dumpFile(self, path: str) -> int:
+        with lprofile.stage("dump"):
+            size = self._prepare()
+
+            with open(path, 'w+b') as f:
+                f.truncate(size)
+                if size == 0:
+                    return 0
+
+                with mmap.mmap(f.fileno(), size) as m:
+                    self._packInto(m, 0, size)
+                    m.flush()
+
+        return size
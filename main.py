@@ -2,6 +2,10 @@
 import sys
 import lundump
 import lparser
+import lprofile
+
+# pass --profile after the file to print where the time went
+profiler = lprofile.enable() if "--profile" in sys.argv[2:] else None
 
 lc = lundump.LuaUndump()
 print(sys.argv[1])
@@ -12,4 +16,7 @@ lc.print_dissassembly()
 lp = lparser.LuaDecomp(chunk)
 
 print("\n==== [[" + str(chunk.name) + "'s pseudo-code]] ====\n")
-print(lp.getPseudoCode())
\ No newline at end of file
+print(lp.getPseudoCode())
+
+if profiler is not None:
+    print(profiler.format(), file=sys.stderr)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+'''
+    server.py
+
+    Depends on lundump.py && batch.py.
+
+    A long running decompilation service, so tools calling us hundreds of times a minute don't pay for interpreter
+    startup && imports on every call. Speaks a tiny subset of HTTP/1.1 (keep-alive, Content-Length bodies) over a
+    unix socket or a localhost port:
+        - POST /decompile?emit=lua,dis   body is the raw dump, answers {"outputs": {"lua": ..., "dis": ...}}
+        - GET /stats                     request counters
+
+    Dumps are decoded && decompiled in a pool of warm worker processes, each job gets its own LuaUndump (it's
+    stateful, so it's never shared). Small requests are batched together into one round trip to the pool. Once
+    [maxPending] requests are queued or running new ones are turned away with a 503, && a request that takes longer
+    than [timeout] gets a 504.
+
+    NOTE: a request that timed out while already running in the pool still runs to completion, its result is dropped
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import lundump
+import batch
+
+DEFAULT_PORT = 8151
+
+_STATUS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+# ========================================[[ Worker ]]=========================================
+
+def _warm() -> int:
+    return os.getpid()
+
+# runs in a worker process. [jobs] is a list of (bytecode, emit), every job gets its own result (or error) so one
+# bad dump never fails the rest of its batch
+def decompileBatch(jobs: list[tuple[bytes, list[str]]]) -> list[dict]:
+    results = []
+
+    for bytecode, emit in jobs:
+        start = time.perf_counter()
+        try:
+            chunk = lundump.LuaUndump().decode_rawbytecode(bytecode)
+            outputs = {name: batch.EMITTERS[name][1](chunk) for name in emit}
+            results.append({"outputs": outputs, "seconds": time.perf_counter() - start})
+        except Exception as e:
+            results.append({"error": "%s: %s" % (type(e).__name__, e)})
+
+    return results
+
+# ========================================[[ HTTP ]]=========================================
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# reads a line off [reader]. lines longer than the reader's limit are answered with [status]
+async def _readLine(reader: asyncio.StreamReader, status: int, what: str) -> bytes:
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError): # readline() turns LimitOverrunError into a ValueError
+        raise _HTTPError(status, "%s too long!" % what)
+
+# reads one request off [reader], returns (method, path, query, headers, body) or None once the client hung up
+async def _readRequest(reader: asyncio.StreamReader, maxBody: int) -> tuple:
+    line = await _readLine(reader, 400, "Request line")
+    if not line:
+        return None
+
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise _HTTPError(400, "Malformed request line!")
+
+    headers = {}
+    while True:
+        line = await _readLine(reader, 431, "Header")
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        name, _, val = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = val.strip()
+
+    try:
+        size = int(headers.get("content-length", "0"))
+    except ValueError:
+        size = -1
+
+    if size < 0:
+        raise _HTTPError(400, "Bad Content-Length!")
+
+    if size > maxBody:
+        raise _HTTPError(413, "Dump too large! [%d > %d]" % (size, maxBody))
+
+    body = await reader.readexactly(size) if size > 0 else b""
+    url = urllib.parse.urlsplit(target)
+    return method.upper(), url.path, urllib.parse.parse_qs(url.query), headers, body
+
+def _writeResponse(writer: asyncio.StreamWriter, status: int, payload: dict, keepAlive: bool) -> None:
+    body = json.dumps(payload).encode('utf-8')
+    head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n" % (
+        status, _STATUS.get(status, ""), len(body), "keep-alive" if keepAlive else "close")
+    if status == 503:
+        head += "Retry-After: 1\r\n"
+
+    writer.write(head.encode('latin-1') + b"\r\n" + body)
+
+# ========================================[[ Server ]]=========================================
+
+class _Job:
+    __slots__ = ('bytecode', 'emit', 'future')
+
+    def __init__(self, bytecode: bytes, emit: list[str], future: asyncio.Future):
+        self.bytecode = bytecode
+        self.emit = emit
+        self.future = future
+
+class DecompServer:
+    # requests smaller than [batchBytes] wait up to [batchDelay] seconds for company, up to [batchSize] of them are
+    # sent to the pool together
+    def __init__(self, workers: int = None, maxPending: int = 256, timeout: float = 30.0, batchSize: int = 16,
+                 batchBytes: int = 64 * 1024, batchDelay: float = 0.002, maxBody: int = 64 * 1024 * 1024,
+                 cacheDir: str = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.maxPending = maxPending
+        self.timeout = timeout
+        self.batchSize = batchSize
+        self.batchBytes = batchBytes
+        self.batchDelay = batchDelay
+        self.maxBody = maxBody
+        self.cacheDir = cacheDir
+
+        self.stats = {"requests": 0, "completed": 0, "failed": 0, "rejected": 0, "timeouts": 0, "batches": 0}
+        self._pending = 0 # requests queued or running in the pool
+        self._queue: asyncio.Queue = None
+        self._slots: asyncio.Semaphore = None # batches in flight, so requests wait in our queue (where they can be dropped) && not the pool's
+        self._pool: ProcessPoolExecutor = None
+        self._dispatcher: asyncio.Task = None
+        self._server: asyncio.AbstractServer = None
+
+    def _newPool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=batch.initWorker, initargs=(self.cacheDir,))
+
+    # spins the pool up && waits for every worker to finish importing, so the first requests don't pay for it
+    async def warmUp(self) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, _warm) for _ in range(self.workers)])
+
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: str = None) -> None:
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers * 2)
+        self._pool = self._newPool()
+        await self.warmUp()
+
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+
+    async def serveForever(self) -> None:
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # queues a dump for decompilation, returns the worker's result. raises _HTTPError when we're too busy or it timed out
+    async def submit(self, bytecode: bytes, emit: list[str]) -> dict:
+        if self._pending >= self.maxPending:
+            self.stats["rejected"] += 1
+            raise _HTTPError(503, "Too many pending requests! [%d]" % self._pending)
+
+        self._pending += 1
+        job = _Job(bytecode, emit, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(job)
+
+        try:
+            # on timeout wait_for() cancels the future, so the dispatcher drops the job if it wasn't sent yet
+            return await asyncio.wait_for(job.future, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise _HTTPError(504, "Timed out after %.1fs!" % self.timeout)
+
+    async def _dispatch(self) -> None:
+        while True:
+            jobs = [await self._queue.get()]
+            size = len(jobs[0].bytecode)
+
+            # small requests wait a moment for others to share the round trip with
+            if size < self.batchBytes and self._queue.empty() and self.batchDelay > 0:
+                await asyncio.sleep(self.batchDelay)
+
+            while len(jobs) < self.batchSize and size < self.batchBytes and not self._queue.empty():
+                job = self._queue.get_nowait()
+                jobs.append(job)
+                size += len(job.bytecode)
+
+            await self._slots.acquire()
+
+            # drop whatever timed out while it was waiting
+            live = [job for job in jobs if not job.future.done()]
+            self._pending -= len(jobs) - len(live)
+            if len(live) == 0:
+                self._slots.release()
+                continue
+
+            self.stats["batches"] += 1
+            asyncio.create_task(self._runBatch(live))
+
+    async def _runBatch(self, jobs: list[_Job]) -> None:
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+
+        try:
+            results = await loop.run_in_executor(pool, decompileBatch, [(job.bytecode, job.emit) for job in jobs])
+        except BrokenProcessPool: # a worker died (eg. killed for memory), start over with a fresh pool
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._newPool()
+            results = [{"error": "worker process died"}] * len(jobs)
+        except Exception as e:
+            results = [{"error": "%s: %s" % (type(e).__name__, e)}] * len(jobs)
+        finally:
+            self._pending -= len(jobs)
+            self._slots.release()
+
+        for job, result in zip(jobs, results):
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def _route(self, method: str, path: str, query: dict, body: bytes) -> tuple[int, dict]:
+        if path == "/stats":
+            if method != "GET":
+                raise _HTTPError(405, "Use GET!")
+
+            return 200, dict(self.stats, pending=self._pending, workers=self.workers)
+
+        if path != "/decompile":
+            raise _HTTPError(404, "Unknown path! [%s]" % path)
+
+        if method != "POST":
+            raise _HTTPError(405, "Use POST!")
+
+        emit = [e for name in query.get("emit", ["lua"]) for e in name.split(",") if e]
+        for e in emit:
+            if e not in batch.EMITTERS:
+                raise _HTTPError(400, "Unknown output! [%s]" % e)
+
+        if len(body) < 4 or body[0:4] != lundump._LUAMAGIC:
+            raise _HTTPError(400, "Lua Bytecode expected!")
+
+        self.stats["requests"] += 1
+        result = await self.submit(body, emit)
+
+        if "error" in result:
+            self.stats["failed"] += 1
+            return 400, {"error": result["error"]}
+
+        self.stats["completed"] += 1
+        return 200, result
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                # idle (or stalled) connections are closed after [timeout]
+                try:
+                    request = await asyncio.wait_for(_readRequest(reader, self.maxBody), self.timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                if request is None:
+                    break
+
+                method, path, query, headers, body = request
+                keepAlive = headers.get("connection", "").lower() != "close"
+
+                try:
+                    status, payload = await self._route(method, path, query, body)
+                except _HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": "%s: %s" % (type(e).__name__, e)}
+
+                _writeResponse(writer, status, payload, keepAlive)
+                await writer.drain()
+
+                if not keepAlive:
+                    break
+        except _HTTPError as e: # the request itself was broken, we can't tell where the next one starts
+            try:
+                _writeResponse(writer, e.status, {"error": str(e)}, False)
+                await writer.drain()
+            except ConnectionError: # they're already gone
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(server: DecompServer, host: str, port: int, path: str = None) -> None:
+    await server.start(host, port, path)
+    print("serving on %s with %d workers" % (path or "http://%s:%d" % (host, port), server.workers), file=sys.stderr)
+
+    try:
+        await server.serveForever()
+    finally:
+        await server.close()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve Lua 5.1 disassembly && decompilation over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-u", "--unix", default=None, help="listen on this unix socket instead")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (defaults to the cpu count)")
+    parser.add_argument("--max-pending", type=int, default=256, help="requests queued or running before new ones get a 503")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request gets a 504")
+    parser.add_argument("--batch-size", type=int, default=16, help="most small requests sent to a worker at once")
+    parser.add_argument("--batch-bytes", type=int, default=64 * 1024, help="requests under this size get batched")
+    parser.add_argument("--batch-delay", type=float, default=0.002, help="seconds a small request waits for company")
+    parser.add_argument("--cache", default=None, help="reuse decompiled protos cached in this directory")
+    args = parser.parse_args(argv)
+
+    server = DecompServer(args.jobs, args.max_pending, args.timeout, args.batch_size, args.batch_bytes,
+                          args.batch_delay, cacheDir=args.cache)
+
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+# the modules live at the top of the repo, not in a package
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
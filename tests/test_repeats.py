@@ -0,0 +1,39 @@
+'''
+    test_repeats.py
+
+    Depends on lparser.py && bench.py.
+
+    repeat-until bodies are indented after the fact, make sure every line still ends up where it belongs.
+'''
+
+import pytest
+
+import bench
+from lparser import LuaDecomp
+from lundump import Opcodes
+
+# what the decompiler has to give back for bench.nestedRepeats([depth])
+def nestedRepeatsCode(depth: int, indent: str = "    ") -> str:
+    lines = []
+    for i in range(depth):
+        lines += [indent * i + "repeat", indent * (i + 1) + "f()"]
+    lines += [indent * i + "until g" for i in reversed(range(depth))]
+
+    return "\n".join(lines) + "\n"
+
+@pytest.mark.parametrize("depth", [1, 2, 10, 200])
+def test_nested_repeats(depth):
+    assert LuaDecomp(bench.nestedRepeats(depth)).getPseudoCode() == nestedRepeatsCode(depth)
+
+# i = 0; repeat i = i + 1; repeat i = i + 1 until i > 5 until i > 10. both loops start inside the same
+# statement (the adds are folded into one expression), so 'repeat's get inserted in between other lines
+def test_shared_repeats():
+    _instr, _rk = bench._instr, bench._rk
+    chunk = bench._proto("@sharedRepeats.lua", [
+        _instr(Opcodes.LOADK, 0, 0), _instr(Opcodes.ADD, 0, 0, _rk(1)), _instr(Opcodes.ADD, 0, 0, _rk(1)),
+        _instr(Opcodes.LT, 0, _rk(2), 0), _instr(Opcodes.JMP, 0, -3),
+        _instr(Opcodes.LT, 0, _rk(3), 0), _instr(Opcodes.JMP, 0, -6),
+        _instr(Opcodes.RETURN, 0, 1),
+    ], [0, 1, 5, 10], isVarg=True)
+
+    assert LuaDecomp(chunk).getPseudoCode() == "repeat\nrepeat\n    until 5 < ((0 + 1) + 1) \nuntil 10 < ((0 + 1) + 1) \n"
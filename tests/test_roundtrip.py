@@ -0,0 +1,32 @@
+'''
+    test_roundtrip.py
+
+    Depends on lundump.py && bench.py.
+
+    Every bench corpus has to come back byte for byte after being undumped && dumped again, whether strings are
+    decoded, decoded lazily or kept raw.
+'''
+
+import pytest
+
+import bench
+from lundump import LuaDump, LuaUndump, Opcodes
+
+@pytest.mark.parametrize("name", list(bench.CORPORA))
+@pytest.mark.parametrize("undump", [LuaUndump(), LuaUndump(lazyStrings=True), LuaUndump(stringEncoding=None)],
+                         ids=["decoded", "lazy", "raw"])
+def test_roundtrip(name, undump):
+    data = bench.buildCorpus(name, 0.1)
+
+    for _ in range(2): # twice, so anything that drifts a little every cycle shows up
+        redumped = bytes(LuaDump(undump.decode_rawbytecode(data)).dump())
+        assert redumped == data
+        data = redumped
+
+# str strings latin-1 can't encode are written as utf-8 instead of failing the dump
+def test_dump_falls_back_to_utf8():
+    chunk = bench._proto("@strings.lua", [bench._instr(Opcodes.RETURN, 0, 1)], ["valu\xe9", "snow ☃"], isVarg=True)
+    data = bytes(LuaDump(chunk).dump())
+
+    assert "valu\xe9".encode('latin-1') in data
+    assert "snow ☃".encode('utf-8') in data